@@ -3,9 +3,10 @@ Drivers for solving adjoint problems on sequences of meshes.
 """
 import firedrake
 from firedrake_adjoint import pyadjoint
+from .checkpointing import DiskCheckpointStack, revolve_schedule
 from .interpolation import project
 from .mesh_seq import MeshSeq
-from .utility import AttrDict, norm
+from .utility import AttrDict, LazyFunctionList, maxpy, norm
 from functools import wraps
 import numpy as np
 
@@ -31,9 +32,18 @@ class AdjointMeshSeq(MeshSeq):
             corresponding to either an end time or time
             integrated quantity of interest, respectively,
             as well as an index for the :class:`MeshSeq`
+        :kwarg qoi_type: either ``'end_time'`` or
+            ``'time_integrated'``
+        :kwarg steady: is the problem steady-state?
+        :kwarg mutable_initial_conditions: list of fields
+            whose initial conditions may be modified in-place
+            by the solver. Initial conditions for other
+            fields are not deep-copied before being passed
+            to the solver (defaults to all fields)
         """
         self.qoi_type = kwargs.pop('qoi_type')
         self.steady = kwargs.pop('steady', False)
+        self._solver_mutates_ic = set(kwargs.pop('mutable_initial_conditions', time_partition.fields))
         super(AdjointMeshSeq, self).__init__(
             time_partition, initial_meshes, get_function_spaces,
             get_initial_condition, get_solver, **kwargs
@@ -42,6 +52,7 @@ class AdjointMeshSeq(MeshSeq):
             self._get_qoi = get_qoi
         self.J = 0
         self.controls = None
+        self._qoi_types = {}
 
     @property
     @pyadjoint.no_annotations
@@ -51,15 +62,15 @@ class AdjointMeshSeq(MeshSeq):
     def get_qoi(self, i):
         qoi = self._get_qoi(self, i)
 
-        # Count number of arguments
-        num_kwargs = 0 if qoi.__defaults__ is None else len(qoi.__defaults__)
-        num_args = qoi.__code__.co_argcount - num_kwargs
-        if num_args == 1:
-            self.qoi_type = 'end_time'
-        elif num_args == 2:
-            self.qoi_type = 'time_integrated'
-        else:
-            raise ValueError(f"QoI should have 1 or 2 args, not {num_args}")
+        # Deduce the QoI type from the number of arguments, caching per code object
+        code = qoi.__code__
+        if code not in self._qoi_types:
+            num_kwargs = 0 if qoi.__defaults__ is None else len(qoi.__defaults__)
+            num_args = code.co_argcount - num_kwargs
+            if num_args not in (1, 2):
+                raise ValueError(f"QoI should have 1 or 2 args, not {num_args}")
+            self._qoi_types[code] = ('end_time', 'time_integrated')[num_args-1]
+        self.qoi_type = self._qoi_types[code]
 
         # Wrap as appropriate
         if pyadjoint.tape.annotate_tape():
@@ -104,10 +115,7 @@ class AdjointMeshSeq(MeshSeq):
             assert set(self.fields).issubset(set(sols.keys())), "missing fields from solver"
             assert set(sols.keys()).issubset(set(self.fields)), "more solver outputs than fields"
             if i < N-1:
-                checkpoints.append(AttrDict({
-                    field: project(sols[field], fs[i+1])
-                    for field, fs in self._fs.items()
-                }))
+                checkpoints.append(self._transfer(sols, i))
 
         # Account for end time QoI
         if self.qoi_type == 'end_time':
@@ -116,7 +124,7 @@ class AdjointMeshSeq(MeshSeq):
         return checkpoints
 
     def solve_adjoint(self, solver_kwargs={}, get_adj_values=False,
-                      test_checkpoint_qoi=False):
+                      test_checkpoint_qoi=False, num_snapshots=None, checkpoint_dir=None):
         """
         Solve an adjoint problem on a sequence of subintervals.
 
@@ -145,6 +153,14 @@ class AdjointMeshSeq(MeshSeq):
         :kwarg test_checkpoint_qoi: solve over the final
             subinterval when checkpointing so that the QoI
             value can be checked across runs
+        :kwarg num_snapshots: maximum number of checkpoints
+            held in memory at any one time. If fewer than the
+            number of subintervals, forward solves are repeated
+            according to a binomial checkpointing schedule
+            (defaults to one checkpoint per subinterval)
+        :kwarg checkpoint_dir: if provided, checkpoints are
+            written to disk under this directory, rather than
+            being held in memory
 
         :return solution: an :class:`AttrDict` containing
             solution fields and their lagged versions.
@@ -152,15 +168,8 @@ class AdjointMeshSeq(MeshSeq):
         num_subintervals = len(self)
         function_spaces = self.function_spaces
         P = self.time_partition
-
-        # Solve forward to get checkpoints and evaluate QoI
-        checkpoints = self.get_checkpoints(
-            solver_kwargs=solver_kwargs, run_final_subinterval=test_checkpoint_qoi,
-        )
-        if self.warn and test_checkpoint_qoi and np.isclose(float(self.J), 0.0):
-            self.warning("Zero QoI. Is it implemented as intended?")
-        J_chk = self.J
         self.J = 0
+        J_chk = 0
 
         # Create arrays to hold exported forward and adjoint solutions
         labels = ('forward', 'forward_old', 'adjoint')
@@ -171,10 +180,8 @@ class AdjointMeshSeq(MeshSeq):
         solutions = AttrDict({
             field: AttrDict({
                 label: [
-                    [
-                        firedrake.Function(fs, name='_'.join([field, label]))
-                        for j in range(P.exports_per_subinterval[i]-1)
-                    ] for i, fs in enumerate(function_spaces[field])
+                    LazyFunctionList(fs, P.exports_per_subinterval[i]-1, name='_'.join([field, label]))
+                    for i, fs in enumerate(function_spaces[field])
                 ] for label in labels
             }) for field in self.fields
         })
@@ -182,132 +189,201 @@ class AdjointMeshSeq(MeshSeq):
         # Wrap solver to extract controls
         solver = self.solver
 
+        # Copy initial conditions which the solver may modify in-place, to protect checkpoints
+        def copy_initial_condition(ic):
+            return AttrDict({
+                field: ic[field].copy(deepcopy=field in self._solver_mutates_ic)
+                for field in self.fields
+            })
+
         @wraps(solver)
         def wrapped_solver(i, ic, **kwargs):
-            init = AttrDict({field: ic[field].copy(deepcopy=True) for field in self.fields})
+            init = copy_initial_condition(ic)
             self.controls = [pyadjoint.Control(init[field]) for field in self.fields]
             return solver(i, init, **kwargs)
 
+        @pyadjoint.no_annotations
+        def unannotated_solver(i, ic, **kwargs):
+            J = self.J
+            self.J = 0
+            sols = solver(i, copy_initial_condition(ic), **kwargs)
+            assert issubclass(sols.__class__, dict), "solver should return a dict"
+            assert set(self.fields).issubset(set(sols.keys())), "missing fields from solver"
+            assert set(sols.keys()).issubset(set(self.fields)), "more solver outputs than fields"
+            J, self.J = self.J, J
+            return sols, J
+
         # Clear tape
         tape = pyadjoint.get_working_tape()
         tape.clear_tape()
+        self._solve_block_cache = None
+
+        # Loop over subintervals in reverse, according to a binomial checkpointing schedule
+        seeds = {}
+        advanced = set()
+        if checkpoint_dir is None:
+            snapshots = {}
+        else:
+            snapshots = DiskCheckpointStack(function_spaces, directory=checkpoint_dir)
+        checkpoint = self.initial_condition
+        schedule = revolve_schedule(num_subintervals, num_snapshots or num_subintervals)
+        try:
+            for k, (action, i) in enumerate(schedule):
+                if action == 'takeshot':
+                    snapshots[i] = checkpoint
+                    continue
+                elif action == 'restore':
+                    checkpoint = snapshots[i]
+                    continue
+                elif action == 'advance':
+                    sols, J = unannotated_solver(i, checkpoint, **solver_kwargs)
+                    if i not in advanced:
+                        J_chk += J
+                        advanced.add(i)
+                    with pyadjoint.stop_annotating():
+                        checkpoint = self._transfer(sols, i)
+                    continue
+
+                # Start reading the next checkpoint to be restored from disk
+                if checkpoint_dir is not None:
+                    restores = [j for action, j in schedule[k+1:] if action == 'restore']
+                    if len(restores) > 0:
+                        snapshots.prefetch(restores[0])
+
+                # Evaluate QoI without annotation over the final subinterval, for comparison
+                if i == num_subintervals-1 and test_checkpoint_qoi:
+                    sols, J = unannotated_solver(i, checkpoint, **solver_kwargs)
+                    if self.qoi_type == 'end_time':
+                        with pyadjoint.stop_annotating():
+                            J = self.get_qoi(i)(sols, **solver_kwargs.get('qoi_kwargs', {}))
+                    J_chk += J
+                    if self.warn and np.isclose(float(J_chk), 0.0):
+                        self.warning("Zero QoI. Is it implemented as intended?")
 
-        # Loop over subintervals in reverse
-        seeds = None
-        for i in reversed(range(num_subintervals)):
+                # Annotate tape on current subinterval
+                sols = wrapped_solver(i, checkpoint, **solver_kwargs)
 
-            # Annotate tape on current subinterval
-            sols = wrapped_solver(i, checkpoints[i], **solver_kwargs)
+                # Get seed vector for reverse propagation
+                if i == num_subintervals-1:
+                    if self.qoi_type == 'end_time':
+                        qoi = self.get_qoi(i)
+                        self.J = qoi(sols, **solver_kwargs.get('qoi_kwargs', {}))
+                        if self.warn and np.isclose(float(self.J), 0.0):
+                            self.warning("Zero QoI. Is it implemented as intended?")
+                else:
+                    with pyadjoint.stop_annotating():
+                        for field, fs in function_spaces.items():
+                            sols[field].block_variable.adj_value = project(seeds[field], fs[i], adjoint=True)
 
-            # Get seed vector for reverse propagation
-            if i == num_subintervals-1:
-                if self.qoi_type == 'end_time':
-                    qoi = self.get_qoi(i)
-                    self.J = qoi(sols, **solver_kwargs.get('qoi_kwargs', {}))
-                    if self.warn and np.isclose(float(self.J), 0.0):
-                        self.warning("Zero QoI. Is it implemented as intended?")
-            else:
+                # Solve adjoint problem
+                m = pyadjoint.enlisting.Enlist(self.controls)
                 with pyadjoint.stop_annotating():
-                    for field, fs in function_spaces.items():
-                        sols[field].block_variable.adj_value = project(seeds[field], fs[i], adjoint=True)
-
-            # Solve adjoint problem
-            m = pyadjoint.enlisting.Enlist(self.controls)
-            with pyadjoint.stop_annotating():
-                with tape.marked_nodes(m):
-                    tape.evaluate_adj(markings=True)
-            # FIXME: Using mixed Functions as Controls not correct
-
-            # Loop over prognostic variables
-            for field, fs in function_spaces.items():
-
-                # Get solve blocks
-                solve_blocks = self.get_solve_blocks(field, subinterval=i)
-                num_solve_blocks = len(solve_blocks)
-                assert num_solve_blocks > 0, "Looks like no solves were written to tape!" \
-                                             + " Does the solution depend on the initial condition?"
-                if fs[0].ufl_element() != solve_blocks[0].function_space.ufl_element():
-                    raise ValueError(f"Solve block list for field {field} contains mismatching"
-                                     + f" elements ({fs[0].ufl_element()} vs. "
-                                     + f" {solve_blocks[0].function_space.ufl_element()})")
-                if 'forward_old' in solutions[field]:
-                    fwd_old_idx = self.get_lagged_dependency_index(field, i, solve_blocks)
-                else:
-                    fwd_old_idx = None
-                if fwd_old_idx is None and 'forward_old' in solutions[field]:
-                    solutions[field].pop('forward_old')
-
-                # Detect whether we have a steady problem
-                steady = self.steady or (num_subintervals == 1 and num_solve_blocks == 1)
-                if steady and 'adjoint_next' in sols:
-                    sols.pop('adjoint_next')
-
-                # Extract solution data
-                sols = solutions[field]
-                stride = P.timesteps_per_export[i]*self.solves_per_timestep
-                if len(solve_blocks[::stride]) >= P.exports_per_subinterval[i]:
-                    self.warning(f"More solve blocks than expected ({len(solve_blocks[::stride])} >"
-                                 + f" {P.exports_per_subinterval[i]-1})")
-                for j, block in zip(range(P.exports_per_subinterval[i]-1), solve_blocks[::stride]):
-
-                    # Lagged forward solution and adjoint values
-                    if fwd_old_idx is not None:
-                        dep = block._dependencies[fwd_old_idx]
-                        sols.forward_old[i][j].assign(dep.saved_output)
-                        if get_adj_values:
-                            sols.adj_value[i][j].assign(dep.adj_value.function)
-
-                    # Lagged adjoint solution
-                    if not steady:
-                        if j*stride+1 < num_solve_blocks:
-                            if self.solves_per_timestep == 1:
-                                if solve_blocks[j*stride+1].adj_sol is not None:
-                                    sols.adjoint_next[i][j].assign(solve_blocks[j*stride+1].adj_sol)
+                    with tape.marked_nodes(m):
+                        tape.evaluate_adj(markings=True)
+                # FIXME: Using mixed Functions as Controls not correct
+
+                # Loop over prognostic variables
+                for field, fs in function_spaces.items():
+
+                    # Get solve blocks
+                    solve_blocks = self.get_solve_blocks(field, subinterval=i)
+                    num_solve_blocks = len(solve_blocks)
+                    assert num_solve_blocks > 0, "Looks like no solves were written to tape!" \
+                                                 + " Does the solution depend on the initial condition?"
+                    if fs[0].ufl_element() != solve_blocks[0].function_space.ufl_element():
+                        raise ValueError(f"Solve block list for field {field} contains mismatching"
+                                         + f" elements ({fs[0].ufl_element()} vs. "
+                                         + f" {solve_blocks[0].function_space.ufl_element()})")
+                    if 'forward_old' in solutions[field]:
+                        fwd_old_idx = self.get_lagged_dependency_index(field, i, solve_blocks)
+                    else:
+                        fwd_old_idx = None
+                    if fwd_old_idx is None and 'forward_old' in solutions[field]:
+                        solutions[field].pop('forward_old')
+
+                    # Detect whether we have a steady problem
+                    steady = self.steady or (num_subintervals == 1 and num_solve_blocks == 1)
+                    if steady and 'adjoint_next' in sols:
+                        sols.pop('adjoint_next')
+
+                    # Extract solution data
+                    sols = solutions[field]
+                    stride = P.timesteps_per_export[i]*self.solves_per_timestep
+                    num_export_blocks = -(-num_solve_blocks//stride)  # ceiling division
+                    if num_export_blocks >= P.exports_per_subinterval[i]:
+                        self.warning(f"More solve blocks than expected ({num_export_blocks} >"
+                                     + f" {P.exports_per_subinterval[i]-1})")
+                    for j in range(min(num_export_blocks, P.exports_per_subinterval[i]-1)):
+                        block = solve_blocks[j*stride]
+
+                        # Lagged forward solution and adjoint values
+                        if fwd_old_idx is not None:
+                            dep = block._dependencies[fwd_old_idx]
+                            sols.forward_old[i][j].assign(dep.saved_output)
+                            if get_adj_values:
+                                sols.adj_value[i][j].assign(dep.adj_value.function)
+
+                        # Lagged adjoint solution
+                        if not steady:
+                            if j*stride+1 < num_solve_blocks:
+                                if self.solves_per_timestep == 1:
+                                    if solve_blocks[j*stride+1].adj_sol is not None:
+                                        sols.adjoint_next[i][j].assign(solve_blocks[j*stride+1].adj_sol)
+                                else:
+                                    rk_blocks = self.get_rk_blocks(field, i, j, solve_blocks, offset=1)
+                                    maxpy(sols.adjoint_next[i][j], self.tableau.b,
+                                          [rk_block.adj_sol for rk_block in rk_blocks])
+                            elif j*stride+1 == num_solve_blocks:
+                                if i+1 < num_subintervals:
+                                    project(sols.adjoint_next[i+1][0], sols.adjoint_next[i][j], adjoint=True)
                             else:
-                                rk_blocks = self.get_rk_blocks(field, i, j, solve_blocks, offset=1)
-                                for rk_block, wq in zip(rk_blocks, self.tableau.b):
-                                    if rk_block.adj_sol is not None:
-                                        sols.adjoint_next[i][j] += wq*rk_block.adj_sol
-                        elif j*stride+1 == num_solve_blocks:
-                            if i+1 < num_subintervals:
-                                sols.adjoint_next[i][j].assign(
-                                    project(sols.adjoint_next[i+1][0], fs[i], adjoint=True)
-                                )
-                        else:
-                            raise IndexError(f"Cannot extract solve block {j*stride+1} > {num_solve_blocks}")
+                                raise IndexError(f"Cannot extract solve block {j*stride+1} > {num_solve_blocks}")
 
-                    # Forward and adjoint solution at current timestep
-                    if self.solves_per_timestep == 1:
-                        sols.forward[i][j].assign(block._outputs[0].saved_output)
-                        if block.adj_sol is not None:
-                            sols.adjoint[i][j].assign(block.adj_sol)
-                    else:
-                        assert fwd_old_idx is not None, "Need old solution for RK methods"
-                        assert self.tableau is not None, "Need Butcher tableau for RK methods"
-                        sols.forward[i][j].assign(sols.forward_old[i][j])
-                        for rk_block, wq in zip(self.get_rk_blocks(field, i, j, solve_blocks), self.tableau.b):
-                            sols.forward[i][j] += wq*rk_block._outputs[0].saved_output
-                            if rk_block.adj_sol is not None:
-                                sols.adjoint[i][j] += wq*rk_block.adj_sol
-
-                # Check non-zero adjoint solution/value
-                if self.warn and np.isclose(norm(solutions[field].adjoint[i][0]), 0.0):
-                    self.warning(f"Adjoint solution for field {field} on subinterval {i} is zero.")
-                if self.warn and get_adj_values and np.isclose(norm(sols.adj_value[i][0]), 0.0):
-                    self.warning(f"Adjoint action for field {field} on subinterval {i} is zero.")
-
-            # Get adjoint action
-            seeds = {
-                field: firedrake.Function(function_spaces[field][i],
-                                          val=control.block_variable.adj_value)
-                for field, control in zip(self.fields, self.controls)
-            }
-            for field, seed in seeds.items():
-                if self.warn and np.isclose(norm(seed), 0.0):
-                    self.warning(f"Adjoint action for field {field} on subinterval {i} is zero.")
-                    if steady:
-                        self.warning("  You seem to have a steady-state problem. Presumably it is linear?")
-            tape.clear_tape()
+                        # Forward and adjoint solution at current timestep
+                        if self.solves_per_timestep == 1:
+                            sols.forward[i][j].assign(block._outputs[0].saved_output)
+                            if block.adj_sol is not None:
+                                sols.adjoint[i][j].assign(block.adj_sol)
+                        else:
+                            assert fwd_old_idx is not None, "Need old solution for RK methods"
+                            assert self.tableau is not None, "Need Butcher tableau for RK methods"
+                            rk_blocks = self.get_rk_blocks(field, i, j, solve_blocks)
+                            sols.forward[i][j].assign(sols.forward_old[i][j])
+                            maxpy(sols.forward[i][j], self.tableau.b,
+                                  [rk_block._outputs[0].saved_output for rk_block in rk_blocks])
+                            maxpy(sols.adjoint[i][j], self.tableau.b, [rk_block.adj_sol for rk_block in rk_blocks])
+
+                    # Check non-zero adjoint solution/value
+                    if self.warn and np.isclose(norm(solutions[field].adjoint[i][0], norm_type='l2'), 0.0):
+                        self.warning(f"Adjoint solution for field {field} on subinterval {i} is zero.")
+                    if self.warn and get_adj_values and np.isclose(norm(sols.adj_value[i][0], norm_type='l2'), 0.0):
+                        self.warning(f"Adjoint action for field {field} on subinterval {i} is zero.")
+
+                # Get adjoint action, reusing seed Functions where possible
+                for field, control in zip(self.fields, self.controls):
+                    fs = function_spaces[field][i]
+                    if field not in seeds or seeds[field].function_space() != fs:
+                        seeds[field] = firedrake.Function(fs)
+                    adj_value = control.block_variable.adj_value
+                    if adj_value is None:
+                        seeds[field].assign(0.0)
+                        continue
+                    with adj_value.dat.vec_ro as src, seeds[field].dat.vec_wo as dst:
+                        src.copy(dst)
+                for field, seed in seeds.items():
+                    if self.warn and np.isclose(norm(seed, norm_type='l2'), 0.0):
+                        self.warning(f"Adjoint action for field {field} on subinterval {i} is zero.")
+                        if steady:
+                            self.warning("  You seem to have a steady-state problem. Presumably it is linear?")
+                tape.clear_tape()
+                self._solve_block_cache = None
+
+                # Free checkpoints which are no longer needed
+                for key in [key for key in snapshots if key >= i]:
+                    snapshots.pop(key)
+        finally:
+            if checkpoint_dir is not None:
+                snapshots.close()
 
         # Check the QoI value agrees with that due to the checkpointing run
         if self.qoi_type == 'time_integrated' and test_checkpoint_qoi:
@@ -350,6 +426,10 @@ def solve_adjoint(*args, **kwargs):
     :kwarg test_checkpoint_qoi: solve over the final
         subinterval when checkpointing so that the QoI
         value can be checked across runs
+    :kwarg num_snapshots: maximum number of checkpoints
+        held in memory at any one time
+    :kwarg checkpoint_dir: if provided, checkpoints are
+        written to disk under this directory
 
     :return solution: an :class:`AttrDict` containing
         solution fields and their lagged versions.
@@ -357,5 +437,7 @@ def solve_adjoint(*args, **kwargs):
     assert len(args) == 6
     solve_adjoint_kwargs = dict(solver_kwargs=kwargs.pop('solver_kwargs', {}),
                                 get_adj_values=kwargs.pop('get_adj_values', False),
-                                test_checkpoint_qoi=kwargs.pop('test_checkpoint_qoi', False))
+                                test_checkpoint_qoi=kwargs.pop('test_checkpoint_qoi', False),
+                                num_snapshots=kwargs.pop('num_snapshots', None),
+                                checkpoint_dir=kwargs.pop('checkpoint_dir', None))
     return AdjointMeshSeq(*args, **kwargs).solve_adjoint(**solve_adjoint_kwargs)
@@ -0,0 +1,224 @@
+"""
+Checkpointing schedules for reverse sweeps over
+sequences of subintervals.
+
+.. rubric:: References
+
+.. bibliography:: references.bib
+    :filter: docname in docnames
+"""
+from .utility import AttrDict, Function
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from math import comb
+import numpy as np
+import os
+import shutil
+import tempfile
+
+
+__all__ = ["revolve_schedule", "DiskCheckpointStack"]
+
+
+def _num_reversible_steps(snaps, reps):
+    """
+    Maximum number of steps which may be reversed
+    using ``snaps`` snapshots and at most ``reps``
+    repeated forward runs of each step.
+    """
+    return comb(snaps + reps, snaps)
+
+
+def revolve_schedule(num_steps, snaps):
+    """
+    Binomial checkpointing schedule of Griewank and
+    Walther :cite:`GW00` for reversing a sequence of
+    ``num_steps`` subintervals, using at most ``snaps``
+    simultaneously stored snapshots.
+
+    The schedule is given as a list of ``(action, index)``
+    pairs, where the action is one of:
+
+      * ``'takeshot'``: store the current state as the
+        snapshot at the start of subinterval ``index``;
+      * ``'restore'``: reset the current state to the
+        snapshot at the start of subinterval ``index``;
+      * ``'advance'``: solve forward over subinterval
+        ``index`` without annotation;
+      * ``'youturn'``: solve forward over subinterval
+        ``index`` with annotation and then reverse it.
+
+    Once the ``'youturn'`` action has been applied for
+    subinterval ``index``, snapshots associated with it
+    and any later subinterval are no longer required.
+
+    If ``snaps`` is at least ``num_steps`` then a
+    snapshot is taken at the start of each subinterval
+    and no forward run is repeated.
+
+    :arg num_steps: number of subintervals
+    :arg snaps: maximum number of snapshots, including
+        that for the initial condition
+    """
+    if num_steps < 1:
+        raise ValueError(f"Cannot reverse {num_steps} steps")
+    if snaps < 1:
+        raise ValueError(f"Need at least one snapshot, not {snaps}")
+    schedule = [('takeshot', 0)]
+
+    def reverse(start, end, free):
+        """
+        Reverse subintervals ``start`` to ``end-1``, given
+        that the current state corresponds to a snapshot
+        at ``start`` and ``free`` snapshots are available.
+        """
+        n = end - start
+        if n == 1:
+            schedule.append(('youturn', start))
+        elif free == 0:
+            for k, step in enumerate(reversed(range(start, end))):
+                if k > 0:
+                    schedule.append(('restore', start))
+                schedule.extend(('advance', s) for s in range(start, step))
+                schedule.append(('youturn', step))
+        else:
+            # Take the next snapshot as far along as possible, such that
+            # the subintervals before it can be reversed with one fewer
+            # repetition, while those after it still need them all
+            reps = 1
+            while _num_reversible_steps(free + 1, reps) < n:
+                reps += 1
+            mid = start + min(_num_reversible_steps(free + 1, reps - 1),
+                              n - _num_reversible_steps(free, reps - 1))
+            schedule.extend(('advance', s) for s in range(start, mid))
+            schedule.append(('takeshot', mid))
+            reverse(mid, end, free - 1)
+            schedule.append(('restore', start))
+            reverse(start, mid, free)
+
+    reverse(0, num_steps, min(snaps, num_steps) - 1)
+    return schedule
+
+
+class DiskCheckpointStack(object):
+    """
+    Store checkpoints on disk, rather than in memory,
+    so that only a small number of them are resident
+    at any one time.
+
+    The stack is indexed by subinterval. Each process
+    writes its local part of each :class:`Function` to
+    a separate file, within a temporary directory which
+    is unique to the stack. The most recently used
+    checkpoints are cached in memory, and checkpoints
+    may be prefetched from disk in a background thread.
+    """
+    def __init__(self, function_spaces, directory=None, cache_size=2):
+        """
+        :arg function_spaces: :class:`AttrDict` of lists of
+            :class:`FunctionSpace` s, indexed by field and
+            then by subinterval
+        :kwarg directory: directory under which to store
+            the checkpoints (defaults to the system temporary
+            directory)
+        :kwarg cache_size: number of checkpoints to cache
+            in memory
+        """
+        self.function_spaces = function_spaces
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = tempfile.mkdtemp(prefix='pyroteus_', dir=directory)
+        self.rank = next(iter(function_spaces.values()))[0].mesh().comm.rank
+        self.cache_size = cache_size
+        self._cache = OrderedDict()
+        self._indices = set()
+        self._prefetched = {}
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _fname(self, field, i):
+        return os.path.join(self.directory, f"{field}_{i}_{self.rank}.npy")
+
+    def _read(self, i):
+        return {field: np.load(self._fname(field, i)) for field in self.function_spaces}
+
+    def _cache_insert(self, i, checkpoint):
+        self._cache[i] = checkpoint
+        self._cache.move_to_end(i)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    def __contains__(self, i):
+        return i in self._indices
+
+    def __iter__(self):
+        return iter(sorted(self._indices))
+
+    def __setitem__(self, i, checkpoint):
+        self.push(i, checkpoint)
+
+    def __getitem__(self, i):
+        return self.load(i)
+
+    def push(self, i, checkpoint):
+        """
+        Write the checkpoint associated with
+        subinterval ``i`` to disk.
+        """
+        for field, f in checkpoint.items():
+            with f.dat.vec_ro as v:
+                np.save(self._fname(field, i), v.array_r)
+        self._indices.add(i)
+        self._prefetched.pop(i, None)
+        self._cache_insert(i, checkpoint)
+
+    def prefetch(self, i):
+        """
+        Start reading the checkpoint associated with
+        subinterval ``i`` from disk in the background.
+        """
+        if i in self._indices and i not in self._cache and i not in self._prefetched:
+            self._prefetched[i] = self._executor.submit(self._read, i)
+
+    def load(self, i):
+        """
+        Load the checkpoint associated with
+        subinterval ``i``.
+        """
+        if i not in self._indices:
+            raise KeyError(f"No checkpoint stored for subinterval {i}")
+        if i in self._cache:
+            self._cache.move_to_end(i)
+            return self._cache[i]
+        future = self._prefetched.pop(i, None)
+        arrays = self._read(i) if future is None else future.result()
+        checkpoint = AttrDict()
+        for field, fs in self.function_spaces.items():
+            checkpoint[field] = Function(fs[i], name=field)
+            with checkpoint[field].dat.vec_wo as v:
+                v.array[:] = arrays[field]
+        self._cache_insert(i, checkpoint)
+        return checkpoint
+
+    def pop(self, i):
+        """
+        Remove the checkpoint associated with
+        subinterval ``i`` from disk and memory.
+        """
+        self._indices.discard(i)
+        self._cache.pop(i, None)
+        future = self._prefetched.pop(i, None)
+        if future is not None:
+            future.result()
+        for field in self.function_spaces:
+            fname = self._fname(field, i)
+            if os.path.exists(fname):
+                os.remove(fname)
+
+    def close(self):
+        """
+        Remove all checkpoints and clean up.
+        """
+        for i in list(self._indices):
+            self.pop(i)
+        self._executor.shutdown()
+        shutil.rmtree(self.directory, ignore_errors=True)
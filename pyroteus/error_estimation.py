@@ -65,7 +65,8 @@ def form2estimator(F, absolute_value=False):
     indicator = form2indicator(F)
     if absolute_value:
         indicator.interpolate(abs(indicator))
-    return indicator.vector().gather().sum()
+    with indicator.dat.vec_ro as v:
+        return v.sum()
 
 
 def get_dwr_indicator(F, adjoint_error):
@@ -3,11 +3,18 @@ Driver functions for mesh-to-mesh data transfer.
 """
 from __future__ import absolute_import
 from .utility import *
+from pyadjoint.tape import annotate_tape
+import weakref
 
 
 __all__ = ["project"]
 
 
+_MASS_SOLVER_CACHE = {}
+_MIXED_MASS_CACHE = {}
+_WORKSPACE_CACHE = {}
+
+
 # --- Linear interpolation
 
 # TODO
@@ -55,8 +62,12 @@ def mesh2mesh_project(source, target, adjoint=False, **kwargs):
 
     This function extends to the case of mixed spaces.
 
-    Extra keyword arguments are passed to Firedrake's
-    ``project`` function.
+    If no extra keyword arguments are provided and the
+    tape is not being annotated then the projection is
+    applied using mass matrices which are cached for
+    each pair of spaces. Otherwise, extra keyword
+    arguments are passed to Firedrake's ``project``
+    function.
 
     :arg source: the :class:`Function` to be projected
     :arg target: the :class:`Function` which we
@@ -71,13 +82,24 @@ def mesh2mesh_project(source, target, adjoint=False, **kwargs):
     target_space = target.function_space()
     if source_space == target_space:
         target.assign(source)
+        return target
     elif hasattr(target_space, 'num_sub_spaces'):
         assert hasattr(source_space, 'num_sub_spaces')
         assert target_space.num_sub_spaces() == source_space.num_sub_spaces()
-        for s, t in zip(source.split(), target.split()):
-            t.project(s, **kwargs)
+        components = zip(source.split(), target.split())
     else:
-        target.project(source, **kwargs)
+        components = [(source, target)]
+    cached = len(kwargs) == 0 and not annotate_tape()
+    for s, t in components:
+        if not cached:
+            t.project(s, **kwargs)
+            continue
+        ksp = _get_mass_solver(t.function_space())
+        mixed_mass = _get_mixed_mass_matrix(s.function_space(), t.function_space())
+        rhs = _get_workspace(t.function_space())
+        with s.dat.vec_ro as sv, t.dat.vec_wo as tv:
+            mixed_mass.mult(sv, rhs)
+            ksp.solve(rhs, tv)
     return target
 
 
@@ -100,8 +122,6 @@ def mesh2mesh_project_adjoint(target_b, source_b, **kwargs):
     :arg source_b: the :class:`Function` from the source
         space of the forward projection
     """
-    from firedrake.supermeshing import assemble_mixed_mass_matrix
-
     target_space = target_b.function_space()
     assert isinstance(source_b, firedrake.Function)
     source_space = source_b.function_space()
@@ -125,12 +145,89 @@ def mesh2mesh_project_adjoint(target_b, source_b, **kwargs):
 
     # Apply adjoint projection operator to each component
     for i, (t_b, s_b) in enumerate(zip(target_b_split, source_b_split)):
-        ksp = PETSc.KSP().create()
-        ksp.setOperators(assemble_mass_matrix(t_b.function_space()))
-        mixed_mass = assemble_mixed_mass_matrix(t_b.function_space(), s_b.function_space())
+        ksp = _get_mass_solver(t_b.function_space())
+        mixed_mass = _get_mixed_mass_matrix(t_b.function_space(), s_b.function_space())
+        residual = _get_workspace(t_b.function_space())
         with t_b.dat.vec_ro as tb, s_b.dat.vec_wo as sb:
-            residual = tb.copy()
-            ksp.solveTranspose(tb, residual)
+            ksp.solve(tb, residual)  # NOTE: mass matrix is symmetric
             mixed_mass.mult(residual, sb)  # NOTE: mixed mass already transposed
 
     return source_b
+
+
+def _get_mass_solver(space):
+    r"""
+    Get a :class:`KSP` for the mass matrix associated
+    with ``space``.
+
+    These are cached, so that they need only be
+    assembled and set up once for each space. The
+    mass matrix is symmetric positive-definite, so a
+    Cholesky factorisation is computed up front and
+    reused, unless the space is :math:`\mathbb P0_{DG}`,
+    in which case the mass matrix is diagonal.
+
+    The :class:`KSP` lives on the communicator of the
+    underlying mesh and its options may be set using
+    the prefix ``pyroteus_mass_``.
+    """
+    key = id(space)
+    if key not in _MASS_SOLVER_CACHE:
+        mass = assemble_mass_matrix(space)
+        mass.setOption(PETSc.Mat.Option.SYMMETRIC, True)
+        mass.setOption(PETSc.Mat.Option.SPD, True)
+        comm = space.mesh().comm
+        ksp = PETSc.KSP().create(comm=comm)
+        ksp.setOptionsPrefix("pyroteus_mass_")
+        ksp.setOperators(mass)
+        ksp.setType("preonly")
+        pc = ksp.getPC()
+        element = space.ufl_element()
+        if element.family() == 'Discontinuous Lagrange' and element.degree() == 0:
+            pc.setType("jacobi")
+        else:
+            pc.setType("cholesky")
+            if comm.size > 1:
+                pc.setFactorSolverType("mumps")
+        ksp.setFromOptions()
+        ksp.setUp()
+        _MASS_SOLVER_CACHE[key] = ksp
+        weakref.finalize(space, _MASS_SOLVER_CACHE.pop, key, None)
+    return _MASS_SOLVER_CACHE[key]
+
+
+def _get_workspace(space):
+    """
+    Get a work :class:`Vec` compatible with the
+    mass matrix associated with ``space``.
+
+    These are cached, so that they need only be
+    allocated once for each space.
+    """
+    key = id(space)
+    if key not in _WORKSPACE_CACHE:
+        mass = _get_mass_solver(space).getOperators()[0]
+        _WORKSPACE_CACHE[key] = mass.createVecLeft()
+        weakref.finalize(space, _WORKSPACE_CACHE.pop, key, None)
+    return _WORKSPACE_CACHE[key]
+
+
+def _get_mixed_mass_matrix(space_a, space_b):
+    """
+    Get the mixed mass matrix which maps from
+    ``space_a`` to ``space_b``, assembled over
+    the supermesh of the underlying meshes.
+
+    These are cached, so that they need only be
+    assembled once for each pair of spaces.
+    """
+    from firedrake.supermeshing import assemble_mixed_mass_matrix
+
+    key = (id(space_a), id(space_b))
+    if key not in _MIXED_MASS_CACHE:
+        _MIXED_MASS_CACHE[key] = assemble_mixed_mass_matrix(space_a, space_b)
+
+        # Clear the cache entry when either space goes out of scope
+        for space in (space_a, space_b):
+            weakref.finalize(space, _MIXED_MASS_CACHE.pop, key, None)
+    return _MIXED_MASS_CACHE[key]
@@ -2,6 +2,7 @@
 Functions which generate C kernels for dense numerical linear algebra.
 """
 from firedrake import op2
+from functools import lru_cache
 import os
 
 try:
@@ -11,13 +12,31 @@ except ImportError:
 include_dir = ["%s/include/eigen3" % PETSC_ARCH]
 
 
+def _compute(d):
+    """
+    Name of the method used to solve a symmetric
+    eigenvalue problem in ``d`` dimensions.
+
+    In 2D, Eigen's closed-form solver is used. In 3D,
+    its closed-form solver loses accuracy for metrics
+    with (nearly) repeated eigenvalues, so the iterative
+    solver is used instead.
+    """
+    return 'computeDirect' if d == 2 else 'compute'
+
+
+@lru_cache(maxsize=None)
 def eigen_kernel(kernel, *args, **kwargs):
     """
     Helper function to easily pass Eigen kernels
     to Firedrake via PyOP2.
 
-    :arg kernel: a string containing C code which
-        is to be formatted.
+    Kernels are cached, so that the C code for a given
+    kernel and set of arguments is only generated once.
+
+    :arg kernel: a function which returns a string
+        containing C code, given the remaining
+        arguments.
     """
     return op2.Kernel(kernel(*args, **kwargs), kernel.__name__, cpp=True, include_dirs=include_dir)
 
@@ -35,70 +54,92 @@ def postproc_metric(d, a_max):
 
 using namespace Eigen;
 
-void postproc_metric(double A_[%d], const double * h_min_, const double * h_max_)
+void postproc_metric(double A_[%(dd)d], const double * h_min_, const double * h_max_)
 {
 
   // Map input/output metric onto an Eigen object and map h_min/h_max to doubles
-  Map<Matrix<double, %d, %d, RowMajor> > A((double *)A_);
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > A((double *)A_);
   double h_min = *h_min_;
   double h_max = *h_max_;
 
   // Solve eigenvalue problem
-  SelfAdjointEigenSolver<Matrix<double, %d, %d, RowMajor>> eigensolver(A);
-  Matrix<double, %d, %d, RowMajor> Q = eigensolver.eigenvectors();
-  Vector%dd D = eigensolver.eigenvalues();
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(A);
+  Matrix<double, %(d)d, %(d)d, RowMajor> Q = eigensolver.eigenvectors();
+  Vector%(d)dd D = eigensolver.eigenvalues();
 
   // Scale eigenvalues appropriately
   int i;
+  const double la_max = 1.0/(h_min*h_min);
+  const double la_min = 1.0/(h_max*h_max);
   double max_eig = 0.0;
-  for (i=0; i<%d; i++) {
-    D(i) = fmin(pow(h_min, -2), fmax(pow(h_max, -2), abs(D(i))));
+  for (i=0; i<%(d)d; i++) {
+    D(i) = fmin(la_max, fmax(la_min, abs(D(i))));
     max_eig = fmax(max_eig, D(i));
   }
-  for (i=0; i<%d; i++) D(i) = fmax(D(i), pow(%f, -2) * max_eig);
+  const double la_floor = %(inv_a_max_sq)s * max_eig;
+  for (i=0; i<%(d)d; i++) D(i) = fmax(D(i), la_floor);
 
   // Build metric from eigendecomposition
   A = Q * D.asDiagonal() * Q.transpose();
 }
-""" % (d*d, d, d, d, d, d, d, d, d, d, a_max)
+""" % dict(d=d, dd=d*d, compute=_compute(d), inv_a_max_sq=repr(1.0/a_max**2))
 
 
-def intersect(d):
+def intersect(d, n=2):
     """
-    Intersect two metric fields.
+    Intersect ``n`` metric fields.
+
+    The intersection is accumulated pairwise at each
+    node, so that all of the metrics are combined in a
+    single pass.
 
     :arg d: spatial dimension
+    :kwarg n: number of metrics to intersect
     """
+    assert n >= 2, f"Cannot intersect {n:d} metrics."
+    args = ", ".join(f"const double * A{i:d}_" for i in range(n))
+    intersections = "\n".join(
+        f"  intersect_pair(X, Map<const Matrix<double, {d:d}, {d:d}, RowMajor> >(A{i:d}_));"
+        for i in range(1, n)
+    )
     return """
 #include <Eigen/Dense>
 
 using namespace Eigen;
 
-void intersect(double M_[%d], const double * A_, const double * B_) {
-
-  // Map inputs and outputs onto Eigen objects
-  Map<Matrix<double, %d, %d, RowMajor> > M((double *)M_);
-  Map<Matrix<double, %d, %d, RowMajor> > A((double *)A_);
-  Map<Matrix<double, %d, %d, RowMajor> > B((double *)B_);
+// Intersect the metric M with the metric B, in place
+static inline void intersect_pair(Matrix<double, %(d)d, %(d)d, RowMajor> & M, const Matrix<double, %(d)d, %(d)d, RowMajor> & B) {
 
   // Solve eigenvalue problem of first metric, taking square root of eigenvalues
-  SelfAdjointEigenSolver<Matrix<double, %d, %d, RowMajor>> eigensolver(A);
-  Matrix<double, %d, %d, RowMajor> Q = eigensolver.eigenvectors();
-  Matrix<double, %d, %d, RowMajor> D = eigensolver.eigenvalues().array().sqrt().matrix().asDiagonal();
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(M);
+  Matrix<double, %(d)d, %(d)d, RowMajor> Q = eigensolver.eigenvectors();
+  Vector%(d)dd D = eigensolver.eigenvalues().array().sqrt();
 
-  // Compute square root and inverse square root metrics
-  Matrix<double, %d, %d, RowMajor> Sq = Q * D * Q.transpose();
-  Matrix<double, %d, %d, RowMajor> Sqi = Q * D.inverse() * Q.transpose();
+  // Compute square root and inverse square root metrics, expressed in the eigenbasis
+  Matrix<double, %(d)d, %(d)d, RowMajor> Sq = D.asDiagonal() * Q.transpose();
+  Matrix<double, %(d)d, %(d)d, RowMajor> Sqi = D.cwiseInverse().asDiagonal() * Q.transpose();
 
   // Solve eigenvalue problem for triple product of inverse square root metric and the second metric
-  SelfAdjointEigenSolver<Matrix<double, %d, %d, RowMajor>> eigensolver2(Sqi.transpose() * B * Sqi);
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver2;
+  eigensolver2.%(compute)s(Sqi * B * Sqi.transpose());
   Q = eigensolver2.eigenvectors();
-  D = eigensolver2.eigenvalues().array().max(1).matrix().asDiagonal();
+  D = eigensolver2.eigenvalues().array().max(1);
 
   // Compute metric intersection
-  M = Sq.transpose() * Q * D * Q.transpose() * Sq;
+  M.noalias() = Sq.transpose() * Q * D.asDiagonal() * Q.transpose() * Sq;
+}
+
+void intersect(double M_[%(dd)d], %(args)s) {
+
+  // Map output onto an Eigen object and accumulate the intersection
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > M((double *)M_);
+  Matrix<double, %(d)d, %(d)d, RowMajor> X = Map<const Matrix<double, %(d)d, %(d)d, RowMajor> >(A0_);
+%(intersections)s
+  M = X;
 }
-""" % (d*d, d, d, d, d, d, d, d, d, d, d, d, d, d, d, d, d, d, d)
+""" % dict(d=d, dd=d*d, compute=_compute(d), args=args, intersections=intersections)
 
 
 def get_eigendecomposition(d):
@@ -113,19 +154,20 @@ def get_eigendecomposition(d):
 
 using namespace Eigen;
 
-void get_eigendecomposition(double EVecs_[%d], double EVals_[%d], const double * M_) {
+void get_eigendecomposition(double EVecs_[%(dd)d], double EVals_[%(d)d], const double * M_) {
 
   // Map inputs and outputs onto Eigen objects
-  Map<Matrix<double, %d, %d, RowMajor> > EVecs((double *)EVecs_);
-  Map<Vector%dd> EVals((double *)EVals_);
-  Map<Matrix<double, %d, %d, RowMajor> > M((double *)M_);
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > EVecs((double *)EVecs_);
+  Map<Vector%(d)dd> EVals((double *)EVals_);
+  Map<const Matrix<double, %(d)d, %(d)d, RowMajor> > M(M_);
 
   // Solve eigenvalue problem
-  SelfAdjointEigenSolver<Matrix<double, %d, %d, RowMajor>> eigensolver(M);
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(M);
   EVecs = eigensolver.eigenvectors();
   EVals = eigensolver.eigenvalues();
 }
-""" % (d*d, d, d, d, d, d, d, d, d)
+""" % dict(d=d, dd=d*d, compute=_compute(d))
 
 
 def get_reordered_eigendecomposition(d):
@@ -146,10 +188,11 @@ void get_reordered_eigendecomposition(double EVecs_[4], double EVals_[2], const
   // Map inputs and outputs onto Eigen objects
   Map<Matrix<double, 2, 2, RowMajor> > EVecs((double *)EVecs_);
   Map<Vector2d> EVals((double *)EVals_);
-  Map<Matrix<double, 2, 2, RowMajor> > M((double *)M_);
+  Map<const Matrix<double, 2, 2, RowMajor> > M(M_);
 
   // Solve eigenvalue problem
-  SelfAdjointEigenSolver<Matrix<double, 2, 2, RowMajor>> eigensolver(M);
+  SelfAdjointEigenSolver<Matrix<double, 2, 2, RowMajor>> eigensolver;
+  eigensolver.computeDirect(M);
   Matrix<double, 2, 2, RowMajor> Q = eigensolver.eigenvectors();
   Vector2d D = eigensolver.eigenvalues();
 
@@ -171,66 +214,128 @@ void get_reordered_eigendecomposition(double EVecs_[4], double EVals_[2], const
 
 using namespace Eigen;
 
+// Compare and swap entries a and b of the permutation p, without branching
+static inline void cswap(int *p, const Vector3d & D, int a, int b) {
+  bool s = fabs(D(p[a])) <= fabs(D(p[b]));
+  int pa = p[a], pb = p[b];
+  p[a] = s ? pb : pa;
+  p[b] = s ? pa : pb;
+}
+
 void get_reordered_eigendecomposition(double EVecs_[9], double EVals_[3], const double * M_) {
 
   // Map inputs and outputs onto Eigen objects
   Map<Matrix<double, 3, 3, RowMajor> > EVecs((double *)EVecs_);
   Map<Vector3d> EVals((double *)EVals_);
-  Map<Matrix<double, 3, 3, RowMajor> > M((double *)M_);
+  Map<const Matrix<double, 3, 3, RowMajor> > M(M_);
 
   // Solve eigenvalue problem
   SelfAdjointEigenSolver<Matrix<double, 3, 3, RowMajor>> eigensolver(M);
   Matrix<double, 3, 3, RowMajor> Q = eigensolver.eigenvectors();
   Vector3d D = eigensolver.eigenvalues();
 
-  // Reorder eigenpairs by magnitude of eigenvalue
-  if (fabs(D(0)) > fabs(D(1))) {
-    if (fabs(D(1)) > fabs(D(2))) {
-      EVecs = Q;
-      EVals = D;
-    } else if (fabs(D(0)) > fabs(D(2))) {
-      EVecs(0,0) = Q(0,0);EVecs(0,1) = Q(0,2);EVecs(0,2) = Q(0,1);
-      EVecs(1,0) = Q(1,0);EVecs(1,1) = Q(1,2);EVecs(1,2) = Q(1,1);
-      EVecs(2,0) = Q(2,0);EVecs(2,1) = Q(2,2);EVecs(2,2) = Q(2,1);
-      EVals(0) = D(0);
-      EVals(1) = D(2);
-      EVals(2) = D(1);
-    } else {
-      EVecs(0,0) = Q(0,2);EVecs(0,1) = Q(0,0);EVecs(0,2) = Q(0,1);
-      EVecs(1,0) = Q(1,2);EVecs(1,1) = Q(1,0);EVecs(1,2) = Q(1,1);
-      EVecs(2,0) = Q(2,2);EVecs(2,1) = Q(2,0);EVecs(2,2) = Q(2,1);
-      EVals(0) = D(2);
-      EVals(1) = D(0);
-      EVals(2) = D(1);
-    }
-  } else {
-    if (fabs(D(0)) > fabs(D(2))) {
-      EVecs(0,0) = Q(0,1);EVecs(0,1) = Q(0,0);EVecs(0,2) = Q(0,2);
-      EVecs(1,0) = Q(1,1);EVecs(1,1) = Q(1,0);EVecs(1,2) = Q(1,2);
-      EVecs(2,0) = Q(2,1);EVecs(2,1) = Q(2,0);EVecs(2,2) = Q(2,2);
-      EVals(0) = D(1);
-      EVals(1) = D(0);
-      EVals(2) = D(2);
-    } else if (fabs(D(1)) > fabs(D(2))) {
-      EVecs(0,0) = Q(0,1);EVecs(0,1) = Q(0,2);EVecs(0,2) = Q(0,0);
-      EVecs(1,0) = Q(1,1);EVecs(1,1) = Q(1,2);EVecs(1,2) = Q(1,0);
-      EVecs(2,0) = Q(2,1);EVecs(2,1) = Q(2,2);EVecs(2,2) = Q(2,0);
-      EVals(0) = D(1);
-      EVals(1) = D(2);
-      EVals(2) = D(0);
-    } else {
-      EVecs(0,0) = Q(0,2);EVecs(0,1) = Q(0,1);EVecs(0,2) = Q(0,0);
-      EVecs(1,0) = Q(1,2);EVecs(1,1) = Q(1,1);EVecs(1,2) = Q(1,0);
-      EVecs(2,0) = Q(2,2);EVecs(2,1) = Q(2,1);EVecs(2,2) = Q(2,0);
-      EVals(0) = D(2);
-      EVals(1) = D(1);
-      EVals(2) = D(0);
-    }
+  // Reorder eigenpairs by magnitude of eigenvalue, using a sorting network
+  int i, p[3] = {0, 1, 2};
+  cswap(p, D, 0, 1);
+  cswap(p, D, 1, 2);
+  cswap(p, D, 0, 1);
+  for (i=0; i<3; i++) {
+    EVecs.col(i) = Q.col(p[i]);
+    EVals(i) = D(p[i]);
   }
 }
 """
 
 
+def anisotropic_stretching(d, K_hat):
+    """
+    Rescale the eigenvalues of an element-wise metric
+    field by element stretching factors and the ratio
+    of reference to optimal element volume.
+
+    :arg d: spatial dimension
+    :arg K_hat: volume of the reference element
+    """
+    assert d in (2, 3), f"Spatial dimension {d:d} not supported."
+    if d == 2:
+        stretch = """
+  S(0) = sqrt(fabs(D(0)/D(1)));
+  S(1) = sqrt(fabs(D(1)/D(0)));"""
+    else:
+        stretch = """
+  int i;
+  for (i=0; i<3; i++) S(i) = pow(fabs(D(i)*D(i)/(D((i+1)%%3)*D((i+2)%%3))), 1.0/3.0);"""
+    return ("""
+#include <Eigen/Dense>
+
+using namespace Eigen;
+
+void anisotropic_stretching(double M_[%(dd)d], const double * K_opt_) {
+
+  // Map input/output metric onto an Eigen object
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > M((double *)M_);
+
+  // Solve eigenvalue problem
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(M);
+  Matrix<double, %(d)d, %(d)d, RowMajor> Q = eigensolver.eigenvectors();
+  Vector%(d)dd D = eigensolver.eigenvalues();
+
+  // Compute stretching factors
+  Vector%(d)dd S;""" + stretch + """
+
+  // Build metric from eigendecomposition, scaled by the element volume ratio
+  S *= fabs(%(K_hat).17g / *K_opt_);
+  M = Q * S.asDiagonal() * Q.transpose();
+}
+""") % dict(d=d, dd=d*d, K_hat=K_hat, compute=_compute(d))
+
+
+def density_and_quotients(d, reorder=False):
+    """
+    Extract the density and anisotropy quotients
+    from a metric field.
+
+    :arg d: spatial dimension
+    :kwarg reorder: should the quotients correspond
+        to eigenvalues **decreasing** in magnitude?
+    """
+    if reorder:
+        sort = """
+
+  // Reorder eigenvalues by magnitude
+  int j;
+  for (i=1; i<%(d)d; i++) {
+    for (j=i; j>0 && fabs(D(j-1)) < fabs(D(j)); j--) std::swap(D(j-1), D(j));
+  }"""
+    else:
+        sort = ""
+    return ("""
+#include <Eigen/Dense>
+
+using namespace Eigen;
+
+void density_and_quotients(double * density_, double Q_[%(d)d], const double * M_) {
+
+  // Map inputs and outputs onto Eigen objects
+  Map<Vector%(d)dd> Q((double *)Q_);
+  Map<const Matrix<double, %(d)d, %(d)d, RowMajor> > M(M_);
+
+  // Solve eigenvalue problem, without computing eigenvectors
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(M, EigenvaluesOnly);
+  Vector%(d)dd D = eigensolver.eigenvalues();
+  int i;""" + sort + """
+
+  // Extract density and quotients
+  double density = 1.0;
+  for (i=0; i<%(d)d; i++) density *= sqrt(D(i));
+  *density_ = density;
+  for (i=0; i<%(d)d; i++) Q(i) = density*pow(D(i), -%(d)d/2.0);
+}
+""") % dict(d=d, compute=_compute(d))
+
+
 def metric_from_hessian(d):
     """
     Modify the eigenvalues of a Hessian matrix so
@@ -243,34 +348,75 @@ def metric_from_hessian(d):
 
 using namespace Eigen;
 
-void metric_from_hessian(double A_[%d], const double * B_) {
+void metric_from_hessian(double A_[%(dd)d], const double * B_) {
 
   // Map inputs and outputs onto Eigen objects
-  Map<Matrix<double, %d, %d, RowMajor> > A((double *)A_);
-  Map<Matrix<double, %d, %d, RowMajor> > B((double *)B_);
-
-  // Compute mean diagonal and set values appropriately
-  double mean_diag;
-  int i,j;
-  for (i=0; i<%d-1; i++) {
-    for (j=i+1; i<%d; i++) {
-      B(i,j) = 0.5*(B(i,j) + B(j,i));
-      B(j,i) = B(i,j);
-    }
-  }
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > A((double *)A_);
+  Map<const Matrix<double, %(d)d, %(d)d, RowMajor> > B(B_);
+
+  // Symmetrise the Hessian, without modifying the input
+  Matrix<double, %(d)d, %(d)d, RowMajor> H = 0.5*(B + B.transpose());
 
   // Solve eigenvalue problem
-  SelfAdjointEigenSolver<Matrix<double, %d, %d, RowMajor>> eigensolver(B);
-  Matrix<double, %d, %d, RowMajor> Q = eigensolver.eigenvectors();
-  Vector%dd D = eigensolver.eigenvalues();
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(H);
+  Matrix<double, %(d)d, %(d)d, RowMajor> Q = eigensolver.eigenvectors();
+  Vector%(d)dd D = eigensolver.eigenvalues();
 
   // Take modulus of eigenvalues
-  for (i=0; i<%d; i++) D(i) = fmin(1.0e+30, fmax(1.0e-30, abs(D(i))));
+  int i;
+  for (i=0; i<%(d)d; i++) D(i) = fmin(1.0e+30, fmax(1.0e-30, abs(D(i))));
 
   // Build metric from eigendecomposition
   A += Q * D.asDiagonal() * Q.transpose();
 }
-""" % (d*d, d, d, d, d, d, d, d, d, d, d, d, d)
+""" % dict(d=d, dd=d*d, compute=_compute(d))
+
+
+def enforce_spd(d):
+    """
+    Modify the eigenvalues of a metric field in place
+    so that it is positive-definite.
+
+    Nodes at which the metric is already
+    positive-definite are detected using a Cholesky
+    factorisation, so that the eigenvalue problem only
+    needs to be solved where a fix is required.
+
+    :arg d: spatial dimension
+    """
+    return """
+#include <Eigen/Dense>
+
+using namespace Eigen;
+
+void enforce_spd(double M_[%(dd)d]) {
+
+  // Map input/output metric onto an Eigen object and symmetrise it
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > M((double *)M_);
+  Matrix<double, %(d)d, %(d)d, RowMajor> H = 0.5*(M + M.transpose());
+
+  // Check whether the metric is already positive-definite
+  LLT<Matrix<double, %(d)d, %(d)d, RowMajor>> cholesky(H);
+  if (cholesky.info() == Success) {
+    M = H;
+    return;
+  }
+
+  // Solve eigenvalue problem
+  SelfAdjointEigenSolver<Matrix<double, %(d)d, %(d)d, RowMajor>> eigensolver;
+  eigensolver.%(compute)s(H);
+  Matrix<double, %(d)d, %(d)d, RowMajor> Q = eigensolver.eigenvectors();
+  Vector%(d)dd D = eigensolver.eigenvalues();
+
+  // Take modulus of eigenvalues
+  int i;
+  for (i=0; i<%(d)d; i++) D(i) = fmin(1.0e+30, fmax(1.0e-30, abs(D(i))));
+
+  // Build metric from eigendecomposition
+  M = Q * D.asDiagonal() * Q.transpose();
+}
+""" % dict(d=d, dd=d*d, compute=_compute(d))
 
 
 def set_eigendecomposition(d):
@@ -286,14 +432,14 @@ def set_eigendecomposition(d):
 
 using namespace Eigen;
 
-void set_eigendecomposition(double M_[%d], const double * EVecs_, const double * EVals_) {
+void set_eigendecomposition(double M_[%(dd)d], const double * EVecs_, const double * EVals_) {
 
   // Map inputs and outputs onto Eigen objects
-  Map<Matrix<double, %d, %d, RowMajor> > M((double *)M_);
-  Map<Matrix<double, %d, %d, RowMajor> > EVecs((double *)EVecs_);
-  Map<Vector%dd> EVals((double *)EVals_);
+  Map<Matrix<double, %(d)d, %(d)d, RowMajor> > M((double *)M_);
+  Map<const Matrix<double, %(d)d, %(d)d, RowMajor> > EVecs(EVecs_);
+  Map<const Vector%(d)dd> EVals(EVals_);
 
   // Compute metric from eigendecomposition
   M = EVecs * EVals.asDiagonal() * EVecs.transpose();
 }
-""" % (d*d, d, d, d, d, d)
+""" % dict(d=d, dd=d*d)
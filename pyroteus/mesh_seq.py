@@ -4,10 +4,8 @@ Sequences of meshes corresponding to a :class:`TimePartition`.
 import firedrake
 from .interpolation import project
 from .log import debug, warning
-from .utility import AttrDict, Mesh, classify_element, create_section
-from collections import OrderedDict
+from .utility import AttrDict, LazyFunctionList, Mesh, classify_element, create_section, maxpy
 from collections.abc import Iterable
-import numpy as np
 
 
 __all__ = ["MeshSeq"]
@@ -43,12 +41,16 @@ class MeshSeq(object):
         """
         self.time_partition = time_partition
         self.fields = time_partition.fields
+        self._field_set = frozenset(self.fields)
         self.subintervals = time_partition.subintervals
         self.num_subintervals = time_partition.num_subintervals
         self.meshes = initial_meshes
         if not isinstance(self.meshes, Iterable):
-            self.meshes = [Mesh(initial_meshes) for subinterval in self.subintervals]
+            # NOTE: The same mesh is shared, so that function spaces may be reused across subintervals
+            mesh = Mesh(initial_meshes)
+            self.meshes = [mesh for subinterval in self.subintervals]
         self._fs = None
+        self._fs_meshes = None
         if get_function_spaces is not None:
             self._get_function_spaces = get_function_spaces
         if get_initial_condition is not None:
@@ -58,10 +60,11 @@ class MeshSeq(object):
         self.warn = warnings
         self.tableau = kwargs.get('tableau')
         self._lagged_dep_idx = {}
+        self._solve_block_cache = None
         self.sections = [{} for mesh in self]
 
-    def debug(self, msg):
-        debug(f"MeshSeq: {msg}")
+    def debug(self, msg, *args):
+        debug("MeshSeq: " + msg, *args)
 
     def warning(self, msg):
         warning(f"MeshSeq: {msg}")
@@ -99,25 +102,44 @@ class MeshSeq(object):
             )
         return consistent
 
+    @property
+    def _meshes_changed(self):
+        """
+        Have any of the meshes been replaced since the
+        function spaces were last constructed?
+        """
+        if self._fs_meshes is None or len(self._fs_meshes) != len(self.meshes):
+            return True
+        return any(mesh is not fs_mesh for mesh, fs_mesh in zip(self.meshes, self._fs_meshes))
+
     @property
     def function_spaces(self):
-        if self._fs is None or not self._function_spaces_consistent:
-            self._fs = [self.get_function_spaces(mesh) for mesh in self.meshes]
+        if self._fs is None or self._meshes_changed:
+
+            # Reuse function spaces when consecutive subintervals share a mesh
+            self._fs = []
+            for i, mesh in enumerate(self.meshes):
+                if i > 0 and mesh is self.meshes[i-1]:
+                    self._fs.append(self._fs[-1])
+                else:
+                    self._fs.append(self.get_function_spaces(mesh))
             self._fs = AttrDict({
                 field: [
                     self._fs[i][field]
                     for i in range(len(self))
                 ] for field in self.fields
             })
-        assert self._function_spaces_consistent, "Meshes and function spaces are inconsistent"
+            assert self._function_spaces_consistent, "Meshes and function spaces are inconsistent"
+            self._fs_meshes = tuple(self.meshes)
         return self._fs
 
     @property
     def initial_condition(self):
-        ic = OrderedDict(self.get_initial_condition())
-        assert issubclass(ic.__class__, dict), "`get_initial_condition` should return a dict"
-        assert set(self.fields).issubset(set(ic.keys())), "missing fields in initial condition"
-        assert set(ic.keys()).issubset(set(self.fields)), "more initial conditions than fields"
+        ic = self.get_initial_condition()
+        assert isinstance(ic, dict), "`get_initial_condition` should return a dict"
+        if ic.keys() != self._field_set:
+            assert self._field_set <= ic.keys(), "missing fields in initial condition"
+            assert ic.keys() <= self._field_set, "more initial conditions than fields"
         return AttrDict(ic)
 
     @property
@@ -142,19 +164,55 @@ class MeshSeq(object):
             assert set(self.fields).issubclass(set(sols.keys())), "missing fields from solver"
             assert set(sols.keys()).issubclass(set(self.fields)), "more solver outputs than fields"
             if i < len(self)-1:
-                checkpoints.append({
-                    field: project(sols[field], fs[i+1])
-                    for field, fs in self._fs.items()
-                })
+                checkpoints.append(self._transfer(sols, i))
         return checkpoints
 
+    def _transfer(self, sols, i):
+        """
+        Transfer solution fields from subinterval ``i``
+        to the function spaces used on subinterval ``i+1``.
+
+        Fields whose function spaces coincide on the two
+        subintervals are copied, rather than projected.
+        Copies are taken so that solvers may reuse their
+        output :class:`Function` s without overwriting
+        checkpoints.
+        """
+        return AttrDict({
+            field: sols[field].copy(deepcopy=True) if fs[i] == fs[i+1] else project(sols[field], fs[i+1])
+            for field, fs in self._fs.items()
+        })
+
+    def _get_all_solve_blocks(self, blocks):
+        """
+        Get all solve blocks on the tape, other than
+        those for projections.
+
+        The result is cached until the tape changes, so
+        that the tape need only be traversed once for
+        all fields.
+
+        :arg blocks: the blocks on the tape
+        """
+        from firedrake.adjoint.blocks import GenericSolveBlock, ProjectBlock
+
+        # NOTE: Holding a reference to the last block means that its identity cannot be reused
+        last = blocks[-1]
+        cache = self._solve_block_cache
+        if cache is None or cache[0] != len(blocks) or cache[1] is not last:
+            solve_blocks = [
+                block for block in blocks
+                if isinstance(block, GenericSolveBlock) and not isinstance(block, ProjectBlock)
+            ]
+            self._solve_block_cache = cache = (len(blocks), last, solve_blocks)
+        return cache[2]
+
     def get_solve_blocks(self, field, subinterval=0, has_adj_sol=True):
         """
         Get all blocks of the tape corresponding to
         solve steps for prognostic solution ``field``
         on a given ``subinterval``.
         """
-        from firedrake.adjoint.blocks import GenericSolveBlock, ProjectBlock
         from pyadjoint import get_working_tape
 
         # Get all blocks
@@ -164,36 +222,34 @@ class MeshSeq(object):
             return blocks
 
         # Restrict to solve blocks
-        solve_blocks = [
-            block
-            for block in blocks
-            if issubclass(block.__class__, GenericSolveBlock)
-            and not issubclass(block.__class__, ProjectBlock)
-        ]
-        if len(solve_blocks) == 0:
+        all_solve_blocks = self._get_all_solve_blocks(blocks)
+        if len(all_solve_blocks) == 0:
             self.warning("Tape has no solve blocks!")
-            return solve_blocks
+            return []
 
-        # Slice solve blocks by field
+        # Restrict to solve blocks associated with the field
         solve_blocks = [
-            block
-            for block in solve_blocks
-            if block.options_prefix is not None
-            and field in block.options_prefix
+            block for block in all_solve_blocks
+            if block.options_prefix is not None and field in block.options_prefix
         ]
+
+        # Check there are solve blocks for the field
         if len(solve_blocks) == 0:
             self.warning(f"Tape has no solve blocks associated with field {field}.\nHas the options"
                          + " prefix been applied correctly?")
             return solve_blocks
-        self.debug(f"Field '{field}' on subinterval {subinterval} has {len(solve_blocks)} solve blocks")
+        self.debug("Field '%s' on subinterval %d has %d solve blocks", field, subinterval, len(solve_blocks))
 
         # Default adjoint solution to zero, rather than None
         if has_adj_sol:
             if all(block.adj_sol is None for block in solve_blocks):
                 self.warning("No block has an adjoint solution. Has the adjoint equation been solved?")
+            zero = None
             for block in solve_blocks:
                 if block.adj_sol is None:
-                    block.adj_sol = firedrake.Function(self.function_spaces[field][subinterval], name=field)
+                    if zero is None:
+                        zero = firedrake.Function(self.function_spaces[field][subinterval], name=field)
+                    block.adj_sol = zero  # NOTE: shared and only read from
 
         # Check FunctionSpaces are consistent across solve blocks
         element = solve_blocks[0].function_space.ufl_element()
@@ -203,14 +259,14 @@ class MeshSeq(object):
                                  + f" ({element} vs. {block.function_space.ufl_element()})")
 
         # Check the number of timesteps divides the number of solve blocks
-        ratio = len(solve_blocks)/self.time_partition[subinterval].num_timesteps
-        if not np.isclose(np.round(ratio), ratio):
+        num_timesteps = self.time_partition[subinterval].num_timesteps
+        if len(solve_blocks) % num_timesteps != 0:
             self.warning(f"Number of timesteps for field '{field}' does not divide number of solve blocks"
-                         + f" ({self.time_partition[subinterval].num_timesteps} vs. {len(solve_blocks)})")
-        self.solves_per_timestep = int(np.round(ratio))
-        self.debug(f"Number of solves per timestep for field {field}: {self.solves_per_timestep}")
+                         + f" ({num_timesteps} vs. {len(solve_blocks)})")
+        self.solves_per_timestep = round(len(solve_blocks)/num_timesteps)
+        self.debug("Number of solves per timestep for field %s: %d", field, self.solves_per_timestep)
         if self.solves_per_timestep > 1:
-            self.debug(f"It looks like you have a {self.solves_per_timestep} step RK method")
+            self.debug("It looks like you have a %d step RK method", self.solves_per_timestep)
         return solve_blocks
 
     def get_lagged_dependency_index(self, field, subinterval, solve_blocks):
@@ -293,15 +349,14 @@ class MeshSeq(object):
         from firedrake_adjoint import pyadjoint
         num_subintervals = len(self)
         function_spaces = self.function_spaces
+        tp = self.time_partition
 
         # Create arrays to hold exported forward solutions
         solutions = AttrDict({
             field: AttrDict({
                 label: [
-                    [
-                        firedrake.Function(fs, name='_'.join([field, label]))
-                        for j in range(self.time_partition.exports_per_subinterval[i]-1)
-                    ] for i, fs in enumerate(function_spaces[field])
+                    LazyFunctionList(fs, tp.exports_per_subinterval[i]-1, name='_'.join([field, label]))
+                    for i, fs in enumerate(function_spaces[field])
                 ] for label in ('forward', 'forward_old')
             }) for field in self.fields
         })
@@ -312,6 +367,7 @@ class MeshSeq(object):
         # Clear tape
         tape = pyadjoint.get_working_tape()
         tape.clear_tape()
+        self._solve_block_cache = None
 
         checkpoint = self.initial_condition
         for i in range(num_subintervals):
@@ -335,25 +391,32 @@ class MeshSeq(object):
                     solutions[field].pop('forward_old')
 
                 # Extract solution data
-                sols = solutions[field]
-                stride = self.time_partition.timesteps_per_export[i]*self.solves_per_timestep
-                if len(solve_blocks[::stride]) >= self.time_partition.exports_per_subinterval[i]:
-                    raise ValueError(f"More solve blocks than expected ({len(solve_blocks[::stride])} vs."
-                                     + f" {self.time_partition.exports_per_subinterval[i]})")
-                for j, block in enumerate(solve_blocks[::stride]):
-                    if fwd_old_idx is not None:
-                        sols.forward_old[i][j].assign(block._dependencies[fwd_old_idx].saved_output)
-                    if self.solves_per_timestep == 1:
-                        sols.forward[i][j].assign(block._outputs[0].saved_output)
+                fwd = solutions[field].forward[i]
+                fwd_old = None if fwd_old_idx is None else solutions[field].forward_old[i]
+                solves_per_timestep = self.solves_per_timestep
+                stride = tp.timesteps_per_export[i]*solves_per_timestep
+                num_export_blocks = -(-num_solve_blocks//stride)  # ceiling division
+                if num_export_blocks >= tp.exports_per_subinterval[i]:
+                    raise ValueError(f"More solve blocks than expected ({num_export_blocks} vs."
+                                     + f" {tp.exports_per_subinterval[i]})")
+                if solves_per_timestep > 1:
+                    assert fwd_old is not None, "Need old solution for RK methods"
+                    assert self.tableau is not None, "Need Butcher tableau for RK methods"
+                for j in range(num_export_blocks):
+                    block = solve_blocks[j*stride]
+                    if fwd_old is not None:
+                        fwd_old[j].assign(block._dependencies[fwd_old_idx].saved_output)
+                    if solves_per_timestep == 1:
+                        fwd[j].assign(block._outputs[0].saved_output)
                     else:
-                        assert fwd_old_idx is not None, "Need old solution for RK methods"
-                        assert self.tableau is not None, "Need Butcher tableau for RK methods"
-                        sols.forward[i][j].assign(sols.forward_old[i][j])
-                        for rk_block, wq in zip(self.get_rk_blocks(field, i, j, solve_blocks), self.tableau.b):
-                            sols.forward[i][j] += wq*rk_block._outputs[0].saved_output
+                        rk_blocks = self.get_rk_blocks(field, i, j, solve_blocks)
+                        fwd[j].assign(fwd_old[j])
+                        maxpy(fwd[j], self.tableau.b,
+                              [rk_block._outputs[0].saved_output for rk_block in rk_blocks])
 
             # Clear tape
             tape.clear_tape()
+            self._solve_block_cache = None
 
         return solutions
 
@@ -9,6 +9,7 @@ Driver functions for metric-based mesh adaptation.
 from __future__ import absolute_import
 from .utility import *
 from . import kernel as kernels
+from mpi4py import MPI
 
 
 __all__ = ["metric_complexity", "isotropic_metric", "anisotropic_metric", "hessian_metric",
@@ -153,43 +154,22 @@ def element_wise_anisotropic_metric(error_indicator, hessian, target_space=None,
 
     # Get optimal element volume
     K_opt = interpolate(pow(error_indicator, 1/(convergence_rate+1)), P0)
-    K_opt.interpolate(K_opt.vector().gather().sum()/target_complexity*K/K_opt)
+    with K_opt.dat.vec_ro as v:
+        K_opt_sum = v.sum()
+    K_opt.interpolate(K_opt_sum/target_complexity*K/K_opt)
 
-    # Compute eigendecomposition
+    # Rescale eigenvalues by stretching factors and element volume ratio
     P0_ten = TensorFunctionSpace(mesh, "DG", 0)
-    P0_vec = VectorFunctionSpace(mesh, "DG", 0)
     P0_metric = hessian_metric(project(hessian, P0_ten))
-    evectors, evalues = Function(P0_ten), Function(P0_vec)
-    kernel = kernels.eigen_kernel(kernels.get_reordered_eigendecomposition, dim)
-    op2.par_loop(
-        kernel, P0_ten.node_set,
-        evectors.dat(op2.RW), evalues.dat(op2.RW), P0_metric.dat(op2.READ)
-    )
-
-    # Compute stretching factors, in descending order
-    if dim == 2:
-        S = as_vector([
-            sqrt(abs(evalues[0]/evalues[1])),
-            sqrt(abs(evalues[1]/evalues[0])),
-        ])
-    else:
-        S = as_vector([
-            pow(abs((evalues[0]*evalues[0])/(evalues[1]*evalues[2])), 1/3),
-            pow(abs((evalues[1]*evalues[1])/(evalues[2]*evalues[0])), 1/3),
-            pow(abs((evalues[2]*evalues[2])/(evalues[0]*evalues[1])), 1/3),
-        ])
-
-    # Assemble metric
-    evalues.interpolate(abs(K_hat/K_opt)*S)
-    kernel = kernels.eigen_kernel(kernels.set_eigendecomposition, dim)
-    op2.par_loop(
-        kernel, P0_ten.node_set, P0_metric.dat(op2.RW),
-        evectors.dat(op2.READ), evalues.dat(op2.READ)
-    )
+    kernel = kernels.eigen_kernel(kernels.anisotropic_stretching, dim, K_hat)
+    op2.par_loop(kernel, P0_ten.node_set, P0_metric.dat(op2.RW), K_opt.dat(op2.READ))
 
     # Project metric into target space and ensure SPD
     target_space = target_space or TensorFunctionSpace(mesh, "CG", 1)
-    return hessian_metric(project(P0_metric, target_space))
+    metric = project(P0_metric, target_space)
+    kernel = kernels.eigen_kernel(kernels.enforce_spd, dim)
+    op2.par_loop(kernel, target_space.node_set, metric.dat(op2.RW))
+    return metric
 
 
 def vertex_wise_anisotropic_metric(error_indicators, hessians, target_space=None, **kwargs):
@@ -284,11 +264,15 @@ def space_normalise(metric, target, p):
     # Compute global normalisation factor
     detM = det(metric)
     integral = assemble(sqrt(detM)*dx if p == 'inf' else pow(detM, p/(2*p + d))*dx)
-    global_norm = Constant(pow(target/integral, 2/d))
+    global_norm = pow(target/integral, 2/d)
 
     # Normalise
-    determinant = 1 if p == 'inf' else pow(det(metric), -1/(2*p + d))
-    metric.interpolate(global_norm*determinant*metric)
+    if p == 'inf':
+        with metric.dat.vec as v:
+            v.scale(global_norm)
+    else:
+        data = metric.dat.data
+        data *= global_norm*pow(np.linalg.det(data), -1/(2*p + d))[:, None, None]
     return metric
 
 
@@ -317,12 +301,16 @@ def space_time_normalise(metrics, end_time, timesteps, target, p):
     for metric, tau in zip(metrics, dt_per_mesh):
         detM = det(metric)
         integral += assemble(tau*sqrt(detM)*dx if p == 'inf' else pow(tau**2*detM, p/(2*p + d))*dx)
-    global_norm = Constant(pow(target/integral, 2/d))
+    global_norm = pow(target/integral, 2/d)
 
     # Normalise on each subinterval
     for metric, tau in zip(metrics, dt_per_mesh):
-        determinant = 1 if p == 'inf' else pow(tau**2*det(metric), -1/(2*p + d))
-        metric.interpolate(global_norm*determinant*metric)
+        if p == 'inf':
+            with metric.dat.vec as v:
+                v.scale(global_norm)
+        else:
+            data = metric.dat.data
+            data *= global_norm*pow(float(tau)**2*np.linalg.det(data), -1/(2*p + d))[:, None, None]
     return metrics
 
 
@@ -345,12 +333,12 @@ def metric_relaxation(*metrics, weights=None, function_space=None):
             "Number of weights do not match number of metrics"
             + f"({len(weights)} vs. {n})")
     fs = function_space or metrics[0].function_space()
-    relaxed_metric = Function(fs)
-    for weight, metric in zip(weights, metrics):
-        if not isinstance(metric, Function) or metric.function_space() != fs:
-            metric = interpolate(metric, function_space)
-        relaxed_metric += weight*metric
-    return relaxed_metric
+    metrics = [
+        metric if isinstance(metric, Function) and metric.function_space() == fs
+        else interpolate(metric, fs)
+        for metric in metrics
+    ]
+    return maxpy(Function(fs), weights, metrics)
 
 
 def metric_average(*metrics, function_space=None):
@@ -377,22 +365,22 @@ def metric_intersection(*metrics, function_space=None, boundary_tag=None):
     n = len(metrics)
     assert n > 0, "Nothing to combine"
     fs = function_space or metrics[0].function_space()
-    for metric in metrics:
-        if not isinstance(metric, Function) or metric.function_space() != fs:
-            metric = interpolate(metric, function_space)
-    intersected_metric = Function(metrics[0])
+    metrics = [
+        metric if isinstance(metric, Function) and metric.function_space() == fs
+        else interpolate(metric, fs)
+        for metric in metrics
+    ]
+    if n == 1:
+        return Function(metrics[0])
     node_set = fs.node_set if boundary_tag is None else DirichletBC(fs, 0, boundary_tag).node_set
     dim = fs.mesh().topological_dimension()
     assert dim in (2, 3), f"Spatial dimension {dim:d} not supported."
+    kernel = kernels.eigen_kernel(kernels.intersect, dim, n)
 
-    def intersect_pair(M1, M2):
-        M12 = Function(M1)
-        kernel = kernels.eigen_kernel(kernels.intersect, dim)
-        op2.par_loop(kernel, node_set, M12.dat(op2.RW), M1.dat(op2.READ), M2.dat(op2.READ))
-        return M12
-
-    for metric in metrics[1:]:
-        intersected_metric = intersect_pair(intersected_metric, metric)
+    # NOTE: Only a boundary intersection needs values copied from the first metric at untouched nodes
+    intersected_metric = Function(fs) if boundary_tag is None else Function(metrics[0])
+    op2.par_loop(kernel, node_set, intersected_metric.dat(op2.RW),
+                 *[metric.dat(op2.READ) for metric in metrics])
     return intersected_metric
 
 
@@ -464,23 +452,13 @@ def density_and_quotients(metric, reorder=False):
     dim = mesh.topological_dimension()
 
     # Setup fields
-    evectors = Function(fs_ten)
-    evalues = Function(fs_vec)
     density = Function(fs, name="Metric density")
     quotients = Function(fs_vec, name="Anisotropic quotients")
 
-    # Compute eigendecomposition
-    if reorder:
-        kernel = kernels.eigen_kernel(kernels.get_reordered_eigendecomposition, dim)
-    else:
-        kernel = kernels.eigen_kernel(kernels.get_eigendecomposition, dim)
+    # Extract density and quotients from the eigenvalues
+    kernel = kernels.eigen_kernel(kernels.density_and_quotients, dim, reorder)
     op2.par_loop(kernel, fs_ten.node_set,
-                 evectors.dat(op2.RW), evalues.dat(op2.RW), metric.dat(op2.READ))
-
-    # Extract density and quotients
-    h = [1/sqrt(evalues[i]) for i in range(dim)]
-    density.interpolate(1/prod(h))
-    quotients.interpolate(as_vector([density*h[i]**dim for i in range(dim)]))
+                 density.dat(op2.RW), quotients.dat(op2.RW), metric.dat(op2.READ))
     return density, quotients
 
 
@@ -488,11 +466,22 @@ def is_symmetric(M, rtol=1.0e-08):
     """
     Determine whether a tensor field is symmetric.
 
+    The test is applied to the degrees of freedom of
+    the field directly: the field is deemed symmetric
+    if the largest absolute difference between any
+    nodal tensor and its transpose is at most ``rtol``
+    times the largest absolute entry of the field,
+    taken over all processes.
+
     :arg M: the tensor field
     :kwarg rtol: relative tolerance for the test
     """
-    err = assemble(abs(det(M - transpose(M)))*dx)
-    return err/assemble(abs(det(M))*dx) < rtol
+    mesh = M.function_space().mesh()
+    dim = mesh.topological_dimension()
+    data = M.dat.data_ro.reshape(-1, dim, dim)
+    err = mesh.comm.allreduce(np.abs(data - data.swapaxes(1, 2)).max(initial=0.0), op=MPI.MAX)
+    scale = mesh.comm.allreduce(np.abs(data).max(initial=0.0), op=MPI.MAX)
+    return err <= rtol*scale
 
 
 def is_pos_def(M):
@@ -507,7 +496,8 @@ def is_pos_def(M):
     evalues = Function(fs_vec)
     kernel = kernels.eigen_kernel(kernels.get_eigendecomposition, fs.mesh().topological_dimension())
     op2.par_loop(kernel, fs.node_set, evectors.dat(op2.RW), evalues.dat(op2.RW), M.dat(op2.READ))
-    return evalues.vector().gather().min() > 0.0
+    with evalues.dat.vec_ro as v:
+        return v.min()[1] > 0.0
 
 
 def is_spd(M):
@@ -51,7 +51,8 @@ def double_l2_projection(f, mesh=None, target_spaces=None):
     L = f*dot(phi, n)*ds - f*div(phi)*dx
 
     # Apply stationary preconditioners in the Schur complement to get away
-    # with applying GMRES to the whole mixed system
+    # with applying GMRES to the whole mixed system, using an upper
+    # triangular factorisation to save a Hessian block solve per iteration
     sp = {
         "mat_type": "aij",
         "ksp_type": "gmres",
@@ -60,6 +61,7 @@ def double_l2_projection(f, mesh=None, target_spaces=None):
         "pc_fieldsplit_type": "schur",
         "pc_fieldsplit_0_fields": "1",
         "pc_fieldsplit_1_fields": "0",
+        "pc_fieldsplit_schur_fact_type": "upper",
         "pc_fieldsplit_schur_precondition": "selfp",
         "fieldsplit_0_ksp_type": "preonly",
         "fieldsplit_1_ksp_type": "preonly",
@@ -6,7 +6,8 @@ import firedrake
 from firedrake import *
 from .log import *
 from collections import OrderedDict
-from collections.abc import Iterable
+from collections.abc import Iterable, Sequence
+from numbers import Number
 import firedrake.cython.dmcommon as dmcommon
 
 
@@ -70,7 +71,7 @@ def Mesh(arg, **kwargs):
             if sj:
                 detJ = JacobianDeterminant(mesh)
                 jacobian_sign = sign(detJ)
-                max_product = Max(Max(Max(a*b, a*c), Max(b*c, b*a)), Max(c*a, c*b))
+                max_product = Max(Max(a*b, a*c), b*c)
                 mesh.scaled_jacobian = interpolate(detJ/max_product*jacobian_sign, P0)
 
     return mesh
@@ -111,6 +112,35 @@ def prod(arr):
     return None if n == 0 else arr[0] if n == 1 else arr[0]*prod(arr[1:])
 
 
+def maxpy(y, weights, xs):
+    """
+    Update a :class:`Function` ``y`` in-place with a
+    weighted sum of :class:`Function` s ``xs``, using
+    a single fused PETSc ``VecMAXPY`` operation.
+
+    Any entries of ``xs`` which are ``None`` are
+    skipped. If any of the weights are not numbers
+    or :class:`Constant` s then the weighted sum is
+    interpolated instead.
+
+    :arg y: the :class:`Function` to be updated
+    :arg weights: the weights
+    :arg xs: the :class:`Function` s to be summed
+    """
+    from contextlib import ExitStack
+
+    terms = [(w, x) for w, x in zip(weights, xs) if x is not None]
+    if len(terms) == 0:
+        return y
+    if not all(isinstance(w, (Number, Constant)) for w, x in terms):
+        return y.interpolate(y.copy(deepcopy=True) + sum(w*x for w, x in terms))
+    with ExitStack() as stack:
+        vecs = [stack.enter_context(x.dat.vec_ro) for w, x in terms]
+        with y.dat.vec as v:
+            v.maxpy([float(w) for w, x in terms], vecs)
+    return y
+
+
 def assemble_mass_matrix(space, norm_type='L2'):
     """
     Assemble the ``norm_type`` mass matrix
@@ -229,6 +259,33 @@ class AttrDict(dict):
         self.__dict__ = self
 
 
+class LazyFunctionList(Sequence):
+    """
+    Fixed length list of :class:`Function` s in a
+    common :class:`FunctionSpace`, each of which is
+    only allocated upon first access.
+    """
+    def __init__(self, function_space, length, name=None):
+        """
+        :arg function_space: the :class:`FunctionSpace`
+        :arg length: the number of :class:`Function` s
+        :kwarg name: name to give the :class:`Function` s
+        """
+        self.function_space = function_space
+        self.name = name
+        self._functions = [None]*length
+
+    def __len__(self):
+        return len(self._functions)
+
+    def __getitem__(self, j):
+        if isinstance(j, slice):
+            return [self[k] for k in range(*j.indices(len(self)))]
+        if self._functions[j] is None:
+            self._functions[j] = firedrake.Function(self.function_space, name=self.name)
+        return self._functions[j]
+
+
 def effectivity_index(error_indicator, Je):
     r"""
     Overestimation factor of some error estimator
@@ -246,7 +303,8 @@ def effectivity_index(error_indicator, Je):
     assert isinstance(error_indicator, Function), "Error indicator must return a Function"
     el = error_indicator.ufl_element()
     assert (el.family(), el.degree()) == ('Discontinuous Lagrange', 0), "Error indicator must be P0"
-    eta = error_indicator.vector().gather().sum()
+    with error_indicator.dat.vec_ro as v:
+        eta = v.sum()
     return np.abs(eta/Je)
 
 
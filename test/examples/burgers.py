@@ -56,12 +56,14 @@ def get_solver(self):
         F = inner((u - u_)/dtc, v)*dx \
             + inner(dot(u, nabla_grad(u)), v)*dx \
             + nu*inner(grad(u), grad(v))*dx
+        problem = NonlinearVariationalProblem(F, u)
+        solver_obj = NonlinearVariationalSolver(problem, options_prefix='uv_2d')
 
         # Time integrate from t_start to t_end
         t = t_start
         qoi = self.get_qoi(i)
         while t < t_end - 1.0e-05:
-            solve(F == 0, u, options_prefix='uv_2d')
+            solver_obj.solve()
             if self.qoi_type == 'time_integrated':
                 self.J += qoi({'uv_2d': u}, t)
             u_.assign(u)
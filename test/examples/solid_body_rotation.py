@@ -180,6 +180,7 @@ def get_qoi(self, i, exact=get_initial_condition, linear=True):
     specified shape).
     """
     dtc = Constant(self.time_partition[i].timestep)
+    theta = Constant(0.0)
 
     def time_integrated_qoi(sol, t):
         assert len(list(sol.keys())) == 1
@@ -188,10 +189,7 @@ def get_qoi(self, i, exact=get_initial_condition, linear=True):
         V = q.function_space()
         mesh = V.mesh()
         x = SpatialCoordinate(mesh)
-        W = VectorFunctionSpace(mesh, "CG", 1)
-        theta = -2*pi*t/full_rotation
-        X = interpolate(rotate(x, theta), W)
-        q_exact = exact(self, X)
+        theta.assign(-2*pi*t/full_rotation)
         r0 = 0.15
         if field in ('tracer_2d', 'slot_cyl_2d'):
             x0, y0 = 0.0, 0.25
@@ -201,11 +199,13 @@ def get_qoi(self, i, exact=get_initial_condition, linear=True):
             x0, y0 = 0.0, -0.25
         else:
             raise ValueError(f"Tracer field {field} not recognised")
-        x0, y0 = interpolate(rotate(as_vector([x0, y0]), theta), W)
+        x0, y0 = rotate(as_vector([x0, y0]), theta)
         ball = conditional((x[0] - x0)**2 + (x[1] - y0)**2 < r0**2, 1.0, 0.0)
         if linear:
             return wq*dtc*ball*q*dx
         else:
+            W = VectorFunctionSpace(mesh, "CG", 1)
+            q_exact = exact(self, interpolate(rotate(x, theta), W))
             return wq*dtc*ball*(q-q_exact[field])**2*dx
 
     def end_time_qoi(sol):
@@ -4,6 +4,7 @@ Test adjoint drivers.
 from pyroteus_adjoint import *
 import pytest
 import importlib
+import itertools
 import os
 import sys
 
@@ -186,6 +187,89 @@ def test_adjoint_same_mesh_parallel(problem, qoi_type):
     test_adjoint_same_mesh(problem, qoi_type)
 
 
+def test_adjoint_checkpointing_tape():
+    """
+    Check that advancing and transferring checkpoints
+    between subintervals with different meshes does
+    not write to the tape when forward runs are
+    repeated according to a checkpointing schedule.
+    """
+    from firedrake_adjoint import pyadjoint
+    test_case = importlib.import_module("burgers")
+    tape = pyadjoint.get_working_tape()
+
+    def get_solver(mesh_seq):
+        solver = test_case.get_solver(mesh_seq)
+
+        def wrapped_solver(i, ic, **kwargs):
+            if pyadjoint.annotate_tape():
+                assert len(tape.get_blocks()) == 0, "Tape not empty before annotated solve"
+            return solver(i, ic, **kwargs)
+        return wrapped_solver
+
+    time_partition = TimePartition(
+        test_case.end_time, 2, test_case.dt, test_case.fields,
+        timesteps_per_export=test_case.dt_per_export,
+    )
+    meshes = [test_case.mesh, UnitSquareMesh(16, 16)]
+    mesh_seq = AdjointMeshSeq(
+        time_partition, meshes, test_case.get_function_spaces,
+        test_case.get_initial_condition, get_solver,
+        test_case.get_qoi, qoi_type='end_time', tableau=test_case.tableau,
+    )
+    mesh_seq.solve_adjoint(num_snapshots=1)
+
+
+def test_adjoint_mutable_initial_conditions():
+    """
+    Check that a solver which modifies its initial
+    conditions in-place does not corrupt checkpoints
+    which are restored more than once, and that
+    checkpoints are also preserved when initial
+    conditions are declared immutable, so that they
+    are not deep-copied.
+    """
+    from firedrake_adjoint import pyadjoint
+    test_case = importlib.import_module("burgers")
+
+    def get_solver(mesh_seq):
+        solver = test_case.get_solver(mesh_seq)
+
+        def mutating_solver(i, ic, **kwargs):
+            sols = solver(i, ic, **kwargs)
+            with pyadjoint.stop_annotating():
+                for value in ic.values():
+                    value.assign(0.0)
+            return sols
+        return mutating_solver
+
+    time_partition = TimePartition(
+        test_case.end_time, 4, test_case.dt, test_case.fields,
+        timesteps_per_export=test_case.dt_per_export,
+    )
+    cases = {
+        'reference': (test_case.get_solver, None, {}),
+        'mutating': (get_solver, 1, {}),
+        'immutable': (test_case.get_solver, 1, {'mutable_initial_conditions': []}),
+    }
+    J, adj_sols = {}, {}
+    for case, (get_solver_, num_snapshots, kwargs) in cases.items():
+        mesh_seq = AdjointMeshSeq(
+            time_partition, test_case.mesh, test_case.get_function_spaces,
+            test_case.get_initial_condition, get_solver_,
+            test_case.get_qoi, qoi_type='time_integrated', tableau=test_case.tableau, **kwargs
+        )
+        solutions = mesh_seq.solve_adjoint(num_snapshots=num_snapshots, test_checkpoint_qoi=True)
+        J[case] = mesh_seq.J
+        adj_sols[case] = solutions['uv_2d'].adjoint[0][0]
+    for case in ('mutating', 'immutable'):
+        assert np.isclose(J['reference'], J[case]), f"QoIs do not match in {case} case" \
+                                                    + f" ({J['reference']} vs. {J[case]})"
+        err = errornorm(adj_sols['reference'], adj_sols[case])/norm(adj_sols['reference'])
+        assert np.isclose(err, 0.0), f"Adjoint solutions at initial time do not match in {case}" \
+                                     + f" case. (Error {err:.4e}.)"
+
+
 def plot_solutions(problem, qoi_type, debug=True):
     """
     Plot the forward and adjoint solutions, their lagged
@@ -224,11 +308,12 @@ def plot_solutions(problem, qoi_type, debug=True):
         outfiles.adjoint_next = File(os.path.join(output_dir, 'adjoint_next.pvd'))
         outfiles.adj_value = File(os.path.join(output_dir, 'adj_value.pvd'))
     for label in outfiles:
+        exports = [solutions[field][label][0] for field in time_partition.fields]
         for k in range(time_partition.exports_per_subinterval[0]-1):
-            to_plot = []
-            for field in time_partition.fields:
-                sol = solutions[field][label][0][k]
-                to_plot += [sol] if not hasattr(sol, 'split') else list(sol.split())
+            to_plot = itertools.chain.from_iterable(
+                (sol,) if not hasattr(sol, 'split') else sol.split()
+                for sol in (sols[k] for sols in exports)
+            )
             outfiles[label].write(*to_plot)
 
 
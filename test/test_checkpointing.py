@@ -0,0 +1,56 @@
+"""
+Test checkpointing schedules.
+"""
+from pyroteus.checkpointing import revolve_schedule
+from math import comb
+import pytest
+
+
+# ---------------------------
+# standard tests for pytest
+# ---------------------------
+
+@pytest.fixture(params=[1, 2, 5, 11, 16, 17, 22])
+def num_steps(request):
+    return request.param
+
+
+@pytest.fixture(params=[1, 2, 3, 4, 5, 20])
+def snaps(request):
+    return request.param
+
+
+def test_revolve_schedule(num_steps, snaps):
+    """
+    Check that a binomial checkpointing schedule
+    reverses all steps in order, without exceeding
+    the maximum number of snapshots, and that it
+    uses the optimal number of forward steps.
+    """
+    state, reversed_steps, snapshots, num_advances = 0, [], set(), 0
+    for action, i in revolve_schedule(num_steps, snaps):
+        if action == 'takeshot':
+            assert state == i
+            snapshots.add(i)
+        elif action == 'restore':
+            assert i in snapshots
+            state = i
+        elif action == 'advance':
+            assert state == i
+            state += 1
+            num_advances += 1
+        else:
+            assert action == 'youturn' and state == i
+            reversed_steps.append(i)
+            snapshots = {j for j in snapshots if j < i}
+            state = None
+        assert len(snapshots) <= snaps
+    assert reversed_steps == list(reversed(range(num_steps)))
+    if snaps >= num_steps:
+        assert num_advances == num_steps - 1
+
+    # Compare against the minimal number of forward steps [Griewank and Walther 2000]
+    reps = 0
+    while comb(snaps + reps, snaps) < num_steps:
+        reps += 1
+    assert num_advances == reps*num_steps - comb(snaps + reps, snaps + 1)
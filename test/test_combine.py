@@ -39,3 +39,21 @@ def test_intersection(dim):
 @pytest.mark.parallel
 def test_intersection_parallel(dim):
     test_intersection(dim)
+
+
+def test_relaxation(dim):
+    """
+    Check that metric relaxation DTRT when applied
+    to two isotropic metrics, with weights given as
+    numbers, :class:`Constant` s and :class:`Function` s.
+    """
+    mesh = uniform_mesh(dim, 3)
+    P1 = FunctionSpace(mesh, "CG", 1)
+    P1_ten = TensorFunctionSpace(mesh, "CG", 1)
+    I = Identity(dim)
+    M1 = interpolate(2*I, P1_ten)
+    M2 = interpolate(4*I, P1_ten)
+    M_expected = interpolate(3.5*I, P1_ten)
+    for w in (0.25, Constant(0.25), Function(P1).assign(0.25)):
+        M = metric_relaxation(M1, M2, weights=[w, 0.75])
+        assert np.isclose(errornorm(M_expected, M), 0.0)
@@ -11,11 +11,22 @@ import pytest
 # standard tests for pytest
 # ---------------------------
 
-@pytest.fixture(params=[2, 3])
+@pytest.fixture(scope='module', params=[2, 3])
 def dim(request):
     return request.param
 
 
+@pytest.fixture(scope='module')
+def sensor_metric(dim):
+    """
+    Hessian metric recovered for some arbitrary
+    sensor, shared between tests.
+    """
+    mesh = uniform_mesh(dim, 20)
+    f = prod([sin(pi*xi) for xi in SpatialCoordinate(mesh)])
+    return hessian_metric(recover_hessian(f, mesh=mesh))
+
+
 @pytest.fixture(params=[
     kernels.get_eigendecomposition,
     kernels.get_reordered_eigendecomposition,
@@ -24,7 +35,7 @@ def eigendecomposition_kernel(request):
     return request.param
 
 
-def test_eigendecomposition(dim, eigendecomposition_kernel):
+def test_eigendecomposition(dim, eigendecomposition_kernel, sensor_metric):
     """
     Check decomposition of a metric into its eigenvectors
     and eigenvalues.
@@ -33,13 +44,10 @@ def test_eigendecomposition(dim, eigendecomposition_kernel):
       * Applying `get_eigendecomposition` followed by
         `set_eigendecomposition` should get back the metric.
     """
-    mesh = uniform_mesh(dim, 20)
+    metric = sensor_metric.copy(deepcopy=True)
+    P1_ten = metric.function_space()
+    mesh = P1_ten.mesh()
     P1_vec = VectorFunctionSpace(mesh, "CG", 1)
-    P1_ten = TensorFunctionSpace(mesh, "CG", 1)
-
-    # Recover Hessian metric for some arbitrary sensor
-    f = prod([sin(pi*xi) for xi in SpatialCoordinate(mesh)])
-    metric = hessian_metric(recover_hessian(f, mesh=mesh))
 
     # Extract the eigendecomposition
     evectors, evalues = Function(P1_ten), Function(P1_vec)
@@ -51,7 +59,8 @@ def test_eigendecomposition(dim, eigendecomposition_kernel):
 
     # Check eigenvectors are orthonormal
     VVT = interpolate(dot(evectors, transpose(evectors)), P1_ten)
-    I = interpolate(Identity(dim), P1_ten)
+    I = Function(P1_ten)
+    I.dat.data[:] = np.eye(dim)
     if not np.isclose(norm(Function(I).assign(VVT - I)), 0.0):
         raise ValueError("Eigenvectors are not orthonormal")
 
@@ -61,7 +70,9 @@ def test_eigendecomposition(dim, eigendecomposition_kernel):
         for i in range(dim-1):
             f = interpolate(evalues[i], P1)
             f -= interpolate(evalues[i+1], P1)
-            if f.vector().gather().min() < 0.0:
+            with f.dat.vec_ro as v:
+                f_min = v.min()[1]
+            if f_min < 0.0:
                 raise ValueError(
                     "Eigenvalues are not in descending order"
                 )
@@ -78,20 +89,17 @@ def test_eigendecomposition(dim, eigendecomposition_kernel):
         raise ValueError("Reassembled metric does not match")
 
 
-def test_density_quotients_decomposition(dim, eigendecomposition_kernel):
+def test_density_quotients_decomposition(dim, eigendecomposition_kernel, sensor_metric):
     """
     Check decomposition of a metric into its density
     and anisotropy quotients.
 
     Reassembling should get back the metric.
     """
-    mesh = uniform_mesh(dim, 20)
+    metric = sensor_metric.copy(deepcopy=True)
+    P1_ten = metric.function_space()
+    mesh = P1_ten.mesh()
     P1_vec = VectorFunctionSpace(mesh, "CG", 1)
-    P1_ten = TensorFunctionSpace(mesh, "CG", 1)
-
-    # Recover Hessian metric for some arbitrary sensor
-    f = prod([sin(pi*xi) for xi in SpatialCoordinate(mesh)])
-    metric = hessian_metric(recover_hessian(f, mesh=mesh))
 
     # Extract the eigendecomposition
     evectors, evalues = Function(P1_ten), Function(P1_vec)
@@ -116,3 +124,30 @@ def test_density_quotients_decomposition(dim, eigendecomposition_kernel):
     metric -= reassembled
     if not np.isclose(norm(metric), 0.0):
         raise ValueError("Reassembled metric does not match")
+
+
+def test_metric_from_hessian_symmetric(dim):
+    """
+    Check that a metric constructed from a
+    non-symmetric Hessian is symmetric and
+    that the Hessian itself is unmodified.
+    """
+    mesh = uniform_mesh(dim, 4)
+    P1_ten = TensorFunctionSpace(mesh, "CG", 1)
+
+    # Construct a non-symmetric matrix field
+    X = SpatialCoordinate(mesh)
+    H = as_matrix([[(i + 1)*(X[j] + 1) + j for j in range(dim)] for i in range(dim)])
+    hessian = interpolate(H, P1_ten)
+    hessian_copy = hessian.copy(deepcopy=True)
+
+    # Check the metric is symmetric
+    metric = hessian_metric(hessian)
+    asymmetry = interpolate(metric - transpose(metric), P1_ten)
+    if not np.isclose(norm(asymmetry), 0.0):
+        raise ValueError("Metric is not symmetric")
+
+    # Check the Hessian was not modified
+    hessian -= hessian_copy
+    if not np.isclose(norm(hessian), 0.0):
+        raise ValueError("Hessian was modified")
@@ -0,0 +1,47 @@
+"""
+Test mesh sequences.
+"""
+from pyroteus import *
+import pyroteus.mesh_seq
+import pytest
+
+
+def get_function_spaces(mesh):
+    return {'u': FunctionSpace(mesh, "CG", 1)}
+
+
+@pytest.fixture
+def mesh_seq():
+    time_partition = TimePartition(1.0, 2, 0.5, ['u'])
+    return MeshSeq(time_partition, UnitSquareMesh(4, 4), get_function_spaces, None, None)
+
+
+# ---------------------------
+# standard tests for pytest
+# ---------------------------
+
+def test_transfer_single_mesh(mesh_seq, monkeypatch):
+    """
+    Check that transferring solution fields between
+    subintervals which share a single mesh does not
+    involve a projection, but does take a copy.
+    """
+    def project(*args, **kwargs):
+        raise AssertionError("Unexpected projection between identical function spaces")
+
+    monkeypatch.setattr(pyroteus.mesh_seq, "project", project)
+    assert mesh_seq[0] is mesh_seq[1]
+    u = Function(mesh_seq.function_spaces.u[0]).assign(1.0)
+    transferred = mesh_seq._transfer({'u': u}, 0)
+    assert transferred.u is not u
+    u.assign(2.0)
+    assert np.allclose(transferred.u.dat.data_ro, 1.0)
+
+
+def test_function_spaces_single_mesh(mesh_seq):
+    """
+    Check that function spaces are shared between
+    subintervals when a single mesh is used.
+    """
+    for field, fs in mesh_seq.function_spaces.items():
+        assert fs[0] is fs[1], f"Function spaces for field {field} not shared"